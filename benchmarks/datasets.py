@@ -0,0 +1,176 @@
+import json
+import numpy as np
+import pandas as pd
+
+
+# 2020-01-01 00:00:00 UTC
+START = 1577836800
+
+WORDS = np.array(['GET /index.html', 'POST /api/v1/login', 'user,name', 'say "hi"', 'error', 'warning',
+                  'a much longer value describing an event in some detail', 'x', 'café', 'ok'])
+
+# column names and Devo types of each scenario, eventdate is always the first column
+SCENARIOS = {
+    'narrow': {
+        'types': ['int8', 'float8', 'str'],
+        'nulls': 0.0
+    },
+    'wide': {
+        'types': ['int8', 'int4', 'float8', 'str', 'bool', 'ip4', 'timestamp', 'str'] * 5,
+        'nulls': 0.05
+    },
+    'typed': {
+        'types': ['int8', 'int4', 'float8', 'float4', 'bool', 'str', 'ip4', 'timestamp'],
+        'nulls': 0.0
+    },
+    'nulls': {
+        'types': ['int8', 'int4', 'float8', 'float4', 'bool', 'str', 'ip4', 'timestamp'],
+        'nulls': 0.6
+    }
+}
+
+
+def time_range(rows):
+    """
+    :return: unix start and stop, in seconds, of a dataset of rows
+    """
+    span = max(rows // 1000, 3600)
+    return START, START + span + 1
+
+
+class Dataset:
+    """
+    Rows of a scenario as they are returned by the csv
+    mode of the query API: every value is a string and
+    nulls are empty strings
+
+    Rows are in time order with eventdate spread over
+    one millisecond per row and at least an hour
+    """
+
+    def __init__(self, scenario, rows, seed=0):
+        assert scenario in SCENARIOS, 'scenario must be one of {0}'.format(list(SCENARIOS))
+
+        spec = SCENARIOS[scenario]
+        random = np.random.RandomState(seed)
+
+        self.scenario = scenario
+        self.rows = rows
+
+        self.columns = ['eventdate'] + ['{0}_{1}'.format(t, i) for i, t in enumerate(spec['types'])]
+        self.types = dict(zip(self.columns, ['timestamp'] + spec['types']))
+
+        self.start, self.stop = time_range(rows)
+        self.epochs = np.sort(random.randint(0, (self.stop - self.start - 1) * 1000, rows)).astype(np.int64)
+        self.epochs += START * 1000
+
+        values = {'eventdate': self._timestamps(self.epochs)}
+        for c in self.columns[1:]:
+            col = self._values(self.types[c], rows, random)
+            if spec['nulls']:
+                col[random.random_sample(rows) < spec['nulls']] = ''
+            values[c] = col
+
+        self.frame = pd.DataFrame(values, columns=self.columns)
+
+    @staticmethod
+    def _timestamps(epoch_ms):
+        t = epoch_ms.astype('datetime64[ms]')
+        return np.char.replace(np.datetime_as_string(t, unit='ms'), 'T', ' ').astype(object)
+
+    @classmethod
+    def _values(cls, devo_type, rows, random):
+        if devo_type == 'int8':
+            values = random.randint(-2**40, 2**40, rows, dtype=np.int64)
+        elif devo_type == 'int4':
+            values = random.randint(-2**31, 2**31 - 1, rows, dtype=np.int64)
+        elif devo_type in ('float8', 'float4'):
+            values = np.round(random.standard_normal(rows) * 1000, 6)
+        elif devo_type == 'bool':
+            values = np.where(random.random_sample(rows) < 0.5, 'true', 'false')
+        elif devo_type == 'str':
+            values = WORDS[random.randint(0, len(WORDS), rows)]
+        elif devo_type == 'ip4':
+            octets = random.randint(0, 256, (rows, 4)).astype(str).astype(object)
+            values = octets[:, 0] + '.' + octets[:, 1] + '.' + octets[:, 2] + '.' + octets[:, 3]
+        elif devo_type == 'timestamp':
+            values = cls._timestamps(random.randint(0, 10**12, rows, dtype=np.int64) + START * 1000)
+        else:
+            raise Exception('Unknown type {0}'.format(devo_type))
+
+        return np.asarray(values).astype(str).astype(object)
+
+    def csv_body(self):
+        """
+        :return: header line, body of all rows and the byte
+                 offset of the start of each row in body
+        """
+
+        header = ','.join(self.columns).encode() + b'\n'
+        body = self.frame.to_csv(index=False, header=False, lineterminator='\n').encode()
+
+        ends = np.flatnonzero(np.frombuffer(body, dtype=np.uint8) == ord('\n')) + 1
+        offsets = np.concatenate([[0], ends])
+
+        return header, body, offsets
+
+    def json_rows(self):
+        """
+        :return: rows encoded as json arrays of typed values, as
+                 sent by the json modes of the query API, with
+                 timestamps in milliseconds since epoch
+        """
+
+        columns = []
+        for c in self.columns:
+            col = self.frame[c]
+            nulls = (col == '').to_numpy()
+            devo_type = self.types[c]
+
+            if devo_type == 'timestamp':
+                values = pd.to_datetime(col.where(~nulls)).to_numpy().astype('datetime64[ms]').astype(np.int64)
+                values = values.astype(object)
+            elif devo_type in ('int8', 'int4'):
+                values = np.array([int(v) if v else 0 for v in col], dtype=object)
+            elif devo_type in ('float8', 'float4'):
+                values = np.array([float(v) if v else 0.0 for v in col], dtype=object)
+            elif devo_type == 'bool':
+                values = (col == 'true').to_numpy().astype(object)
+            else:
+                values = col.to_numpy().copy()
+
+            values[nulls] = None
+            columns.append(values)
+
+        return [json.dumps(row).encode() for row in zip(*[col.tolist() for col in columns])]
+
+    def row_lists(self):
+        """
+        :return: rows as lists of strings with eventdate at index 0
+        """
+        return self.frame.values.tolist()
+
+    def typed_frame(self):
+        """
+        :return: DataFrame with the pandas types returned by
+                 API.query(output='dataframe')
+        """
+
+        df = pd.DataFrame(index=self.frame.index)
+
+        for c in self.columns:
+            col = self.frame[c].replace('', np.nan)
+            devo_type = self.types[c]
+
+            if devo_type == 'timestamp':
+                df[c] = pd.to_datetime(col)
+            elif devo_type in ('int8', 'int4'):
+                df[c] = col.astype('float64').astype('Int64')
+            elif devo_type in ('float8', 'float4'):
+                df[c] = col.astype('float64')
+            elif devo_type == 'bool':
+                df[c] = col.map({'true': True, 'false': False})
+            else:
+                df[c] = col
+
+        return df
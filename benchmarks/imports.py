@@ -0,0 +1,94 @@
+"""
+Import time of devodstoolkit
+
+    python benchmarks/imports.py --repeat 20 --save imports.json
+    python benchmarks/imports.py --compare imports.json
+
+Every run imports the package in a new python process and creates an
+API, as a short lived job would before running its first query.  The
+fastest run is reported together with the heavy modules that were
+imported.  The script exits with status 1 if any of the heavy modules
+were imported or, with --compare, if the import got slower than the
+baseline by more than --tolerance
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# only imported when DataFrames or sampling are used
+HEAVY_MODULES = ('numpy', 'pandas', 'scipy')
+
+CHILD = '''
+import sys
+import time
+
+t = time.perf_counter()
+import devodstoolkit
+devodstoolkit.API(end_point='http://127.0.0.1/search/query', api_key='bench', api_secret='bench', schema_cache=False)
+seconds = time.perf_counter() - t
+
+print(seconds)
+print(' '.join(m for m in {0!r} if m in sys.modules))
+'''.format(HEAVY_MODULES)
+
+
+def time_import():
+    """
+    :return: seconds taken to import and create an API in a
+             new process and the heavy modules it imported
+    """
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+
+    seconds, modules = result.stdout.split('\n')[:2]
+
+    return float(seconds), modules.split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10, help='runs, the fastest is reported')
+    parser.add_argument('--save', help='write the result to this json file')
+    parser.add_argument('--compare', help='json file of a result to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    runs = [time_import() for _ in range(args.repeat)]
+    seconds = min(r[0] for r in runs)
+    heavy = sorted(set(m for r in runs for m in r[1]))
+
+    result = {'seconds': seconds, 'heavy_modules': heavy}
+    print('import {0:.1f} ms, heavy modules imported: {1}'.format(seconds * 1000, ', '.join(heavy) or 'none'))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    status = 0
+
+    if heavy:
+        print('Regression: {0} imported with the package'.format(', '.join(heavy)))
+        status = 1
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            before = json.load(f)
+
+        if seconds > before['seconds'] * (1 + args.tolerance):
+            print('Regression in import time: {0:.1f} ms, was {1:.1f} ms'.format(
+                seconds * 1000, before['seconds'] * 1000))
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
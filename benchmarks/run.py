@@ -0,0 +1,295 @@
+"""
+Throughput benchmarks of API.query and Loader against a local
+stand in for the Devo query API and a local TLS relay
+
+    python benchmarks/run.py --rows 1000000 --scenario wide --bench query_dataframe load_df
+
+Every benchmark runs in its own process, which reports rows per
+second, MB per second and bytes per row (of csv received or messages
+sent) and the growth of its peak resident memory while running the
+benchmark.
+Results can be saved with --save and compared to a saved run
+with --compare, which exits with status 1 if any benchmark is
+slower than the baseline by more than --tolerance
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import devodstoolkit as devo
+from datasets import Dataset, SCENARIOS, time_range
+from servers import start_query_server, start_relay, wait_for_relay, make_certificate
+
+
+def peak_memory_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def query_list(api, start, stop):
+    return sum(1 for _ in api.query('from bench', start, stop, output='list'))
+
+
+def query_dict(api, start, stop):
+    return sum(1 for _ in api.query('from bench', start, stop, output='dict'))
+
+
+def query_dataframe(api, start, stop):
+    return len(api.query('from bench', start, stop, output='dataframe'))
+
+
+def query_chunks(api, start, stop):
+    return sum(len(df) for df in api.query('from bench', start, stop, output='dataframe_chunks', chunksize=2**16))
+
+
+def query_parallel(api, start, stop):
+    return len(api.query('from bench', start, stop, output='dataframe', parallel=4))
+
+
+def query_processes(api, start, stop):
+    return sum(1 for _ in api.query('from bench', start, stop, output='list', processes=os.cpu_count()))
+
+
+def query_columns(api, start, stop):
+    columns = api.query('from bench', start, stop, output='columns')
+    return len(columns['eventdate'])
+
+
+def query_json(api, start, stop):
+    return sum(1 for _ in api.query('from bench', start, stop, output='list', mode='json/simple/compact'))
+
+
+def query_json_dataframe(api, start, stop):
+    return len(api.query('from bench', start, stop, output='dataframe', mode='json/compact'))
+
+
+def load(loader, rows):
+    loader.load(rows, 'my.app.bench', ts_index=0)
+
+
+def load_df(loader, df):
+    loader.load_df(df, 'my.app.bench', ts_name='eventdate')
+
+
+def load_file(loader, path):
+    loader.load_file(path, 'my.app.bench', ts_index=0)
+
+
+def load_parallel(loader, df):
+    loader.load_df(df, 'my.app.bench', ts_name='eventdate', connections=4)
+
+
+def load_compact(loader, rows):
+    loader.message_format = 'compact'
+    load(loader, rows)
+
+
+def load_df_compact(loader, df):
+    loader.message_format = 'compact'
+    load_df(loader, df)
+
+
+def load_spool(loader, rows):
+    load(loader, rows)
+
+
+def write_file(dataset, path):
+    dataset.frame.to_csv(path, index=False, header=False)
+    return path
+
+
+QUERY_BENCHMARKS = {f.__name__: f for f in [query_list, query_dict, query_dataframe, query_chunks, query_parallel,
+                                              query_processes, query_columns, query_json, query_json_dataframe]}
+
+# benchmark and the function preparing its data, which is not timed
+LOAD_BENCHMARKS = {
+    'load': (load, lambda dataset, path: dataset.row_lists()),
+    'load_df': (load_df, lambda dataset, path: dataset.typed_frame()),
+    'load_file': (load_file, write_file),
+    'load_parallel': (load_parallel, lambda dataset, path: dataset.typed_frame()),
+    'load_compact': (load_compact, lambda dataset, path: dataset.row_lists()),
+    'load_df_compact': (load_df_compact, lambda dataset, path: dataset.typed_frame()),
+    'load_spool': (load_spool, lambda dataset, path: dataset.row_lists())
+}
+
+# benchmarks timed until rows are written to a spool, which is drained afterwards
+SPOOL_BENCHMARKS = ('load_spool',)
+
+
+def run_query(name, end_point, rows):
+    api = devo.API(end_point=end_point, api_key='bench', api_secret='bench', schema_cache=False)
+    start, stop = time_range(rows)
+
+    base = peak_memory_mb()
+    t = time.perf_counter()
+    count = QUERY_BENCHMARKS[name](api, start, stop)
+    seconds = time.perf_counter() - t
+
+    assert count == rows, 'query returned {0} of {1} rows'.format(count, rows)
+
+    return seconds, api.last_stats.bytes, peak_memory_mb() - base
+
+
+def run_load(name, address, reports, scenario, rows, seed, key, crt):
+    bench, prepare = LOAD_BENCHMARKS[name]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = os.path.join(tmp, 'spool') if name in SPOOL_BENCHMARKS else None
+        loader = devo.Loader(key=key, crt=crt, chain=crt, relay=address[0], timeout=60, spool=spool)
+        loader.address = address
+
+        data = prepare(Dataset(scenario, rows, seed), os.path.join(tmp, 'bench.csv'))
+
+        base = peak_memory_mb()
+        t = time.perf_counter()
+        # _build_linq prints the query of the loaded table
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench(loader, data)
+        seconds = time.perf_counter() - t
+
+        if loader.spool is not None:
+            loader.drain()
+            loader.close()
+
+    received, messages, errors = wait_for_relay(reports, loader.load_stats.bytes)
+
+    assert messages == rows, 'relay received {0} of {1} messages'.format(messages, rows)
+    assert not errors, 'relay received {0} invalid messages'.format(errors)
+
+    return seconds, received, peak_memory_mb() - base
+
+
+def _child(target, args, results):
+    try:
+        results.put(target(*args))
+    except Exception as e:
+        results.put(e)
+
+
+def isolated(target, *args):
+    """
+    Runs target in a new process so the memory
+    used by each benchmark is measured separately
+    """
+
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(target, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: benchmarks whose rows per second dropped by
+             more than tolerance from baseline
+    """
+
+    previous = {(r['scenario'], r['bench']): r for r in baseline}
+    regressions = []
+
+    for r in results:
+        before = previous.get((r['scenario'], r['bench']))
+        if before and r['rows_per_second'] < before['rows_per_second'] * (1 - tolerance):
+            regressions.append((r, before))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--bench', nargs='+', choices=list(QUERY_BENCHMARKS) + list(LOAD_BENCHMARKS),
+                        default=list(QUERY_BENCHMARKS) + list(LOAD_BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each benchmark, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--validate', action='store_true', help='check the format of every message at the relay')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = []
+    print('{0:<8} {1:<20} {2:>10} {3:>9} {4:>12} {5:>9} {6:>9} {7:>9}'.format(
+        'scenario', 'bench', 'rows', 'seconds', 'rows/s', 'MB/s', 'bytes/row', 'peak MB'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        key, crt = make_certificate(tmp)
+
+        for scenario in args.scenario:
+            # the columns of the scenario are needed to validate compact messages
+            relay = start_relay(crt, key, args.validate, len(SCENARIOS[scenario]['types']))
+
+            query_server = None
+            if any(name in QUERY_BENCHMARKS for name in args.bench):
+                json_modes = any(name.startswith('query_json') for name in args.bench)
+                query_server = start_query_server(scenario, args.rows, args.seed, json_modes)
+
+            for name in args.bench:
+                runs = []
+                for _ in range(args.repeat):
+                    if name in QUERY_BENCHMARKS:
+                        runs.append(isolated(run_query, name, query_server[1], args.rows))
+                    else:
+                        runs.append(isolated(run_load, name, relay[1], relay[2], scenario, args.rows, args.seed,
+                                             key, crt))
+
+                seconds, size, peak = min(runs)
+                result = {
+                    'scenario': scenario,
+                    'bench': name,
+                    'rows': args.rows,
+                    'seconds': seconds,
+                    'rows_per_second': args.rows / seconds,
+                    'mb_per_second': size / 2**20 / seconds,
+                    'bytes_per_row': size / args.rows,
+                    'peak_mb': peak
+                }
+                results.append(result)
+
+                print('{scenario:<8} {bench:<20} {rows:>10} {seconds:>9.3f} {rows_per_second:>12,.0f} '
+                      '{mb_per_second:>9.1f} {bytes_per_row:>9.1f} {peak_mb:>9.1f}'.format(**result))
+
+            if query_server is not None:
+                query_server[0].terminate()
+
+            relay[0].terminate()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for r, before in regressions:
+            print('Regression in {scenario} {bench}: {0:,.0f} rows/s, was {1:,.0f}'.format(
+                r['rows_per_second'], before['rows_per_second'], **r))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+import os
+import re
+import ssl
+import json
+import subprocess
+import multiprocessing
+import numpy as np
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from datasets import Dataset
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests made by API._make_request:
+    json/compact with the column types of the dataset and
+    csv with the rows of the dataset between from and to
+    """
+
+    protocol_version = 'HTTP/1.1'
+    write_bytes = 2**20
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        mode = request['mode']['type']
+
+        if mode == 'json/compact' and request.get('limit') == 1:
+            # the schema probe of API._probe_types
+            self._write([json.dumps(self.server.meta).encode()])
+        elif mode in ('json/compact', 'json/simple/compact'):
+            self._write(self.server.json_slice(request['from'], request['to'], mode))
+        elif mode == 'csv':
+            self._write(self.server.slice(request['from'], request['to']))
+        else:
+            self._write([json.dumps({'status': 400, 'object': ['unsupported mode ' + mode]}).encode()])
+
+    def _write(self, parts):
+        self.send_response(200)
+        self.send_header('Content-Length', str(sum(len(part) for part in parts)))
+        self.end_headers()
+
+        for part in parts:
+            for i in range(0, len(part), self.write_bytes):
+                self.wfile.write(part[i:i + self.write_bytes])
+
+    def log_message(self, *args):
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, dataset, json_modes=False):
+        super().__init__(('127.0.0.1', 0), QueryHandler)
+
+        self.dataset = dataset
+        self.epochs = dataset.epochs
+        # encoding rows as json is much slower than csv so it is only done when needed
+        self.json_rows = dataset.json_rows() if json_modes else None
+        self.header, body, self.offsets = dataset.csv_body()
+        self.body = memoryview(body)
+
+        self.meta = {
+            'status': 0,
+            'object': {
+                'm': {c: {'type': dataset.types[c], 'index': i} for i, c in enumerate(dataset.columns)},
+                'd': []
+            }
+        }
+
+    def _range(self, start, stop):
+        """
+        :return: indices of the rows with start <= eventdate < stop,
+                 both in seconds
+        """
+
+        i = np.searchsorted(self.epochs, start * 1000)
+        j = len(self.epochs) if stop is None else np.searchsorted(self.epochs, stop * 1000)
+
+        return i, j
+
+    def slice(self, start, stop):
+        i, j = self._range(start, stop)
+
+        return [self.header, self.body[self.offsets[i]:self.offsets[j]]]
+
+    def json_slice(self, start, stop, mode):
+        if self.json_rows is None:
+            self.json_rows = self.dataset.json_rows()
+
+        i, j = self._range(start, stop)
+        rows = self.json_rows[i:j]
+        meta = json.dumps(self.meta['object']['m']).encode()
+
+        if mode == 'json/compact':
+            return [b'{"status": 0, "object": {"m": ', meta, b', "d": [', b','.join(rows), b']}}']
+
+        return [b'{"m": ', meta, b'}\n', b''.join(b'{"d": ' + row + b'}\n' for row in rows)]
+
+
+class RelayHandler(socketserver.BaseRequestHandler):
+    """
+    Reads the syslog messages sent by Loader over TLS and reports the
+    bytes and messages received once the connection is closed.
+
+    When validating, every message must have the header of
+    _make_message_header and indices matching its payload as
+    built by _make_msg, or offsets matching it as built by
+    _make_compact_msg
+    """
+
+    message = re.compile(rb'<14>.*? (\(usd\))?[\w.]+: ([0-9,]+)<>(.*)')
+    compact_message = re.compile(rb'<14>.*? (\(usd\))?[\w.]+: 2([1-9])(.*)')
+
+    def handle(self):
+        received = 0
+        messages = 0
+        errors = 0
+        rest = b''
+
+        with self.server.context.wrap_socket(self.request, server_side=True) as sock:
+            while True:
+                try:
+                    data = sock.recv(2**20)
+                except (ssl.SSLEOFError, ConnectionResetError):
+                    # Loader closes its sockets without a TLS shutdown
+                    data = b''
+                if not data:
+                    break
+
+                received += len(data)
+                messages += data.count(b'\n')
+
+                if self.server.validate:
+                    lines = (rest + data).split(b'\n')
+                    rest = lines.pop()
+                    errors += sum(not self._valid(line) for line in lines)
+
+        errors += bool(rest)
+        self.server.reports.put((received, messages, errors))
+
+    def _valid(self, line):
+        match = self.message.fullmatch(line)
+        if match is None:
+            return self._valid_compact(line)
+
+        indices = match.group(2).split(b',')
+        return int(indices[-1]) == len(match.group(3).decode('utf-8'))
+
+    def _valid_compact(self, line):
+        match = self.compact_message.fullmatch(line)
+        if match is None or self.server.columns is None:
+            return False
+
+        width = int(match.group(2))
+        end = width * (self.server.columns - 1)
+        offsets, payload = match.group(3)[:end], match.group(3)[end:].decode('utf-8')
+
+        if not offsets.isdigit() and offsets:
+            return False
+
+        offsets = [int(offsets[i:i + width]) for i in range(0, end, width)]
+
+        return offsets == sorted(offsets) and all(o <= len(payload) for o in offsets) and \
+            width == len(str(len(payload)))
+
+
+class Relay(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+
+    def __init__(self, crt, key, reports, validate=False, columns=None):
+        super().__init__(('127.0.0.1', 0), RelayHandler)
+
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(crt, key)
+        # Loader never reads from its socket, so unread TLS 1.3 session tickets
+        # would make it reset the connection on close and drop the end of a load
+        self.context.num_tickets = 0
+
+        self.reports = reports
+        self.validate = validate
+        # columns of each message, needed to validate the compact format
+        self.columns = columns
+
+
+def make_certificate(path):
+    """
+    Writes a self signed key and certificate to path
+    used by the relay and as the credentials of the Loader
+
+    :return: paths of the key and certificate
+    """
+
+    key = os.path.join(path, 'key.pem')
+    crt = os.path.join(path, 'crt.pem')
+
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=localhost', '-keyout', key, '-out', crt],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        raise Exception('openssl is required to create the certificate of the benchmark relay')
+
+    return key, crt
+
+
+def _serve_queries(scenario, rows, seed, json_modes, ready):
+    server = QueryServer(Dataset(scenario, rows, seed), json_modes)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _serve_relay(crt, key, reports, validate, columns, ready):
+    server = Relay(crt, key, reports, validate, columns)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _start(target, *args):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (ready,), daemon=True)
+    process.start()
+
+    return process, ready.get(timeout=600)
+
+
+def start_query_server(scenario, rows, seed=0, json_modes=False):
+    """
+    Serves the dataset of a scenario from another process
+    so it does not compete with the client for the GIL
+
+    :param json_modes: encode the dataset for the json modes when starting
+    :return: the server process and its end point
+    """
+
+    process, port = _start(_serve_queries, scenario, rows, seed, json_modes)
+
+    return process, 'http://127.0.0.1:{0}/search/query'.format(port)
+
+
+def start_relay(crt, key, validate=False, columns=None):
+    """
+    Starts a TLS relay in another process
+
+    :param columns: number of columns of the messages, without
+                    the timestamp, to validate compact messages
+
+    :return: the relay process, its address and a queue of
+             (bytes, messages, invalid messages) of every closed
+             connection
+    """
+
+    reports = multiprocessing.Queue()
+    process, port = _start(_serve_relay, crt, key, reports, validate, columns)
+
+    return process, ('127.0.0.1', port), reports
+
+
+def wait_for_relay(reports, sent, timeout=60):
+    """
+    Collects connection reports until the relay
+    has received the sent number of bytes
+
+    :return: bytes, messages and invalid messages received
+    """
+
+    totals = [0, 0, 0]
+
+    while totals[0] < sent:
+        report = reports.get(timeout=timeout)
+        totals = [total + value for total, value in zip(totals, report)]
+
+    return tuple(totals)
@@ -1,4 +1,9 @@
 from .api import *
 from .loader import *
+from .cache import SchemaCache, ResultCache
+from .stats import QueryStats, LoadStats, TailStats, SpoolStats
+from .tail import Tail
+from .spool import Spool
+from .error_checking import QueryError
 
 __version__ = '0.2.5'
@@ -1,6 +1,9 @@
 import os
 import sys
 import re
+import math
+import random
+import itertools
 import configparser
 import datetime
 from datetime import timezone
@@ -8,15 +11,27 @@ import json
 import hashlib
 import hmac
 import requests
+from requests.adapters import HTTPAdapter
 import csv
+import time
 import warnings
-from collections import namedtuple, defaultdict
-import numpy as np
-import pandas as pd
-from scipy.stats import norm
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 
 
-from .error_checking import check_status
+from .error_checking import check_status, QueryError
+from .columnar import read_dataframe, json_dataframe, read_columns, TextStream
+from .cache import SchemaCache
+from .timestamps import TIMESTAMP_OUTPUTS
+from .export import ARROW_FORMATS, arrow_schema, write_arrow, write_csv
+from .stats import QueryStats
+from .tail import Tail
+from .modes import QUERY_MODES, DECODERS, csv_type_map, json_type_map
+from .processes import convert_rows, row_blocks
+from .lazy import lazy_import
+
+np = lazy_import('numpy', globals(), 'np')
+pd = lazy_import('pandas', globals(), 'pd')
 
 
 csv.field_size_limit(sys.maxsize)
@@ -25,7 +40,21 @@ warnings.simplefilter('always', UserWarning)
 
 class API(object):
 
-    def __init__(self, profile='default', api_key=None, api_secret=None, end_point=None, oauth_token=None, jwt=None):
+    # continuous queries are read in small blocks so rows are
+    # returned as soon as they arrive
+    continuous_block_size = 2**9
+
+    # string columns with more distinct values are not dictionary
+    # encoded by output='columns'
+    max_categories = 2**15
+
+    # draws of a bernoulli sample, including the first, before
+    # randomSample returns fewer rows than asked for
+    max_sample_draws = 4
+
+    def __init__(self, profile='default', api_key=None, api_secret=None, end_point=None, oauth_token=None, jwt=None,
+                 pool_size=10, keep_alive=True, compress=True, schema_cache=True, timestamps='datetime',
+                 result_cache=None, hooks=None, block_size=2**20):
         self.profile = profile
         self.api_key = api_key
         self.api_secret = api_secret
@@ -33,6 +62,25 @@ class API(object):
         self.oauth_token = oauth_token
         self.jwt = jwt
 
+        assert timestamps in TIMESTAMP_OUTPUTS, "timestamps must be in {0}".format(TIMESTAMP_OUTPUTS)
+        self.timestamps = timestamps
+
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.compress = compress
+        self.block_size = block_size
+
+        if schema_cache is True:
+            schema_cache = SchemaCache()
+        elif schema_cache is False:
+            schema_cache = None
+        self.schema_cache = schema_cache
+        self.result_cache = result_cache
+
+        # functions called with the QueryStats of each query once it completes
+        self.hooks = list(hooks or [])
+        self.last_stats = None
+
         if not (self.end_point and (self.oauth_token or self.jwt or (self.api_key and self.api_secret))):
             self._read_profile()
 
@@ -40,6 +88,10 @@ class API(object):
             raise Exception('End point and either API keys or OAuth Token must be specified or in ~/.devo_credentials')
 
         self._make_type_map()
+        self._make_session()
+
+        # row counts of historical queries used by randomSample
+        self._table_sizes = {}
 
     def _read_profile(self):
         """
@@ -66,40 +118,621 @@ class API(object):
         if self.end_point == 'EU':
             self.end_point = 'https://api-eu.logtrust.com/search/query'
 
-    def query(self, linq_query, start, stop=None, output='dict'):
+    def _make_session(self):
+        """
+        Create a pooled session shared by every request made
+        by this object so connections (and their TLS handshakes)
+        are reused between queries and schema probes
+        """
+
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # responses are decompressed as they are streamed by iter_content
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if self.compress else 'identity'
+
+        if not self.keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def close(self):
+        """
+        Close the connections held by the session
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
 
-        valid_outputs = ('dict', 'list', 'namedtuple', 'dataframe')
+    def __exit__(self, *exc):
+        self.close()
+
+    def query(self, linq_query, start, stop=None, output='dict', parallel=None, window=None, types=None,
+              chunksize=None, mode='csv', processes=None, cache=True):
+
+        valid_outputs = ('dict', 'list', 'namedtuple', 'dataframe', 'dataframe_chunks', 'columns')
         assert output in valid_outputs, "output must be in {0}".format(valid_outputs)
 
         assert not (output=='dataframe' and stop is None), "DataFrame can't be build from continuous query"
 
-        results = self._stream(linq_query,start,stop)
+        assert mode in QUERY_MODES, "mode must be in {0}".format(QUERY_MODES)
+        assert mode == 'csv' or not (parallel or window), "Only csv queries can be run in parallel"
+        assert not (mode == 'json/compact' and stop is None), "Use json/simple/compact for continuous queries"
+
+        if processes:
+            assert output in ('dict', 'list', 'namedtuple'), "Only rows can be converted in processes"
+            assert mode == 'csv' and not (parallel or window), "Only csv queries run serially can use processes"
+            assert stop is not None, "Continuous queries can't be converted in processes"
+
+        stats = self._start_stats(linq_query, start, stop)
+
+        if output == 'dataframe_chunks':
+            assert chunksize, "chunksize must be set for dataframe_chunks"
+            assert not (parallel or window), "dataframe_chunks can't be run in parallel"
+            chunks = self._stream_dataframe(linq_query, start, stop, types, stats, chunksize, mode)
+            return self._finish_iter(chunks, stats)
+
+        if output == 'columns':
+            assert stop is not None, "Columns can't be build from continuous query"
+            assert not (parallel or window), "columns can't be run in parallel"
+            columns = self._query_columns(linq_query, start, stop, types, stats, chunksize or 2**16, mode)
+            self._finish_stats(stats)
+            return columns
+
+        if parallel or window:
+            assert stop is not None, "Continuous queries can't be run in parallel"
+
+        if output == 'dataframe':
+            df = self._query_dataframe(linq_query, start, stop, parallel, window, types, stats, mode, cache)
+            self._finish_stats(stats)
+            return df
+
+        if parallel or window:
+            results = self._stream_parallel(linq_query, start, stop, parallel, window, types, stats)
+        elif processes:
+            results = self._stream_processes(linq_query, start, stop, processes, types, stats)
+        else:
+            results = self._stream(linq_query, start, stop, types, stats, mode)
+
         cols = next(results)
 
-        return getattr(self, '_to_{0}'.format(output))(results,cols)
+        return getattr(self, '_to_{0}'.format(output))(self._finish_iter(results, stats),cols)
+
+    def _start_stats(self, linq_query, start, stop):
+        stats = QueryStats(linq_query, start, stop)
+        self.last_stats = stats
+        return stats
+
+    def _finish_stats(self, stats):
+        stats.finished = time.time()
+        for hook in self.hooks:
+            hook(stats)
+
+    def _finish_iter(self, results, stats):
+        """
+        Yields from results and finishes stats once they are
+        exhausted or the generator is closed
+        """
+        try:
+            yield from results
+        finally:
+            self._finish_stats(stats)
+
+    def tail(self, linq_query, start, output='dict', ts_name='eventdate', queue_size=10000, overflow='block',
+             retries=None, retry_wait=1, types=None):
+        """
+        Run a continuous query, reading it in a background thread
+        and reconnecting from the last event timestamp read if the
+        connection is lost
+
+        :param ts_name: column of the event timestamp used to resume
+        :param queue_size: rows read ahead of the consumer
+        :param overflow: when the queue is full 'block' stops reading
+                         the response, 'drop_oldest' and 'drop_newest'
+                         discard rows to keep reading
+        :param retries: reconnection attempts after an error, unlimited if None
+        :param retry_wait: seconds to wait before the first reconnection,
+                           doubled after every failed attempt
+        :return: Tail, an iterable of rows in the format of output
+                 with reader statistics in Tail.stats
+        """
+
+        return Tail(self, linq_query, start, output, ts_name, queue_size, overflow, retries, retry_wait, types)
+
+    def query_to_file(self, linq_query, start, stop, path, format='parquet', chunksize=2**16, types=None):
+        """
+        Run a query and write its results to a file as they
+        arrive, holding at most chunksize rows in memory
+
+        :param path: path of the file to write
+        :param format: 'parquet', 'arrow' (ipc file format) or 'csv'.
+                       parquet and arrow files are written with types from
+                       the schema of the query, one row group or record
+                       batch per chunk, and require pyarrow.  csv files
+                       are written as received without parsing the rows
+        :param chunksize: number of rows in each row group or record batch
+        """
+
+        valid_formats = ARROW_FORMATS + ('csv',)
+        assert format in valid_formats, "format must be in {0}".format(valid_formats)
+
+        assert not (format in ARROW_FORMATS and stop is None), "Continuous queries can't be written to {0}".format(format)
+
+        stats = self._start_stats(linq_query, start, stop)
+        type_dict, cols, lines = self._stream_lines(linq_query, start, stop, types, stats)
+
+        if format == 'csv':
+            stats.rows = write_csv(cols, lines, path)
+        else:
+            schema = arrow_schema(cols, type_dict, self.timestamps)
+
+            chunks = read_dataframe(lines, cols, type_dict, chunksize, timestamps=self.timestamps)
+            write_arrow(self._time_frames(chunks, stats), path, schema, format)
+
+        self._finish_stats(stats)
+
+    def query_many(self, queries, workers=None):
+        """
+        Run many queries concurrently, sharing the connection
+        pool of the session and probing the types of each
+        distinct query only once
+
+        :param queries: list or dict of queries, each a tuple of
+                        (linq_query, start, stop, output), where stop
+                        and output may be left out, or a dict of
+                        keyword arguments of query
+        :param workers: number of queries run at once, pool_size if None
+        :return: dict of the result of each query keyed by its
+                 index in queries, or its key if queries is a dict.
+                 Queries that failed have a QueryError as result
+        """
+
+        keys, specs = self._batch_specs(queries)
+
+        executor = ThreadPoolExecutor(max_workers=workers or self.pool_size)
+        try:
+            futures = self._submit_batch(executor, specs)
+            return {k: f.result() for k, f in zip(keys, futures)}
+        finally:
+            executor.shutdown(wait=False)
+
+    async def query_many_async(self, queries, workers=None):
+        """
+        query_many for use from asyncio.  Queries are run in a
+        pool of worker threads so the event loop is not blocked
+        """
+
+        import asyncio
+
+        keys, specs = self._batch_specs(queries)
+
+        executor = ThreadPoolExecutor(max_workers=workers or self.pool_size)
+        try:
+            futures = self._submit_batch(executor, specs)
+            results = await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+            return dict(zip(keys, results))
+        finally:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _batch_specs(queries):
+        """
+        :return: keys of the queries and the keyword
+                 arguments of query for each of them
+        """
+
+        if isinstance(queries, dict):
+            keys = list(queries)
+            queries = list(queries.values())
+        else:
+            queries = list(queries)
+            keys = list(range(len(queries)))
+
+        specs = []
+        for q in queries:
+            if isinstance(q, dict):
+                spec = dict(q)
+            else:
+                assert 2 <= len(q) <= 4, "queries must be (linq_query, start, stop, output) tuples or dicts"
+                spec = dict(zip(('linq_query', 'start', 'stop', 'output'), q))
+
+            assert spec.get('stop') is not None, "Continuous queries can't be run with query_many"
+            assert spec.get('output') != 'dataframe_chunks', "dataframe_chunks can't be run with query_many"
+            specs.append(spec)
+
+        return keys, specs
+
+    def _submit_batch(self, executor, specs):
+        """
+        Submits one probe for each distinct query without types
+        followed by the queries, which wait for their probe
+
+        :return: futures of the result of each query
+        """
+
+        probes = {}
+        for spec in specs:
+            if spec.get('types') is None and spec.get('mode', 'csv') == 'csv':
+                try:
+                    query_text = SchemaCache.normalize(self._read_query(spec['linq_query']))
+                except Exception as e:
+                    # raised by _batch_query, failing only this query
+                    spec['types'] = Future()
+                    spec['types'].set_exception(e)
+                    continue
+
+                if query_text not in probes:
+                    probes[query_text] = executor.submit(self._get_types, spec['linq_query'], spec['start'])
+                spec['types'] = probes[query_text]
+
+        return [executor.submit(self._batch_query, spec) for spec in specs]
+
+    def _batch_query(self, spec):
+        """
+        Runs a query of query_many, reading all of its rows
+
+        :return: the results or the QueryError raised
+        """
+
+        try:
+            if isinstance(spec.get('types'), Future):
+                spec = dict(spec, types=spec['types'].result())
 
-    def _stream(self, linq_query, start, stop=None):
+            results = self.query(**spec)
+            if spec.get('output', 'dict') not in ('dataframe', 'columns'):
+                results = list(results)
+
+            return results
+
+        except QueryError as e:
+            return e
+        except Exception as e:
+            error = QueryError('{0}: {1}'.format(type(e).__name__, e))
+            error.__cause__ = e
+            return error
+
+    def _stream(self, linq_query, start, stop=None, type_dict=None, stats=None, mode='csv'):
         """
         yields columns names then rows in lists with converted
         types
         """
 
-        type_dict = self._get_types(linq_query, start)
+        stats = stats or QueryStats()
+
+        if mode == 'csv':
+            type_dict, cols, lines = self._stream_lines(linq_query, start, stop, type_dict, stats)
+            reader = csv.reader(lines)
+            type_map = self._map
+        else:
+            type_dict, cols, reader = self._stream_json(linq_query, start, stop, mode, type_dict, stats)
+            type_map = self._json_map
+
+        type_list = [type_map[type_dict[c]] for c in cols]
+
+        yield cols
+
+        clock = time.perf_counter
+
+        while True:
+            tick = clock()
+            row = next(reader, None)
+            if row is None:
+                break
+            row = [t(v) for t, v in zip(type_list, row)]
+            stats.process_seconds += clock() - tick
+            stats.rows += 1
+            yield row
+
+    def _stream_processes(self, linq_query, start, stop, processes, type_dict=None, stats=None):
+        """
+        _stream with the csv split into blocks of whole rows
+        that are parsed and converted by a pool of processes.
+        yields column names then rows in the order received
+        """
+
+        stats = stats or QueryStats()
+
+        type_dict, cols, lines = self._stream_lines(linq_query, start, stop, type_dict, stats)
+        type_names = [type_dict[c] for c in cols]
+
+        yield cols
+
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            try:
+                for block in row_blocks(lines):
+                    pending.append(executor.submit(convert_rows, block, type_names, self.timestamps))
+
+                    # enough blocks are queued to keep every process busy while
+                    # the converted rows of the oldest are yielded
+                    if len(pending) > 2 * processes:
+                        yield from self._converted_rows(pending.popleft(), stats)
+
+                while pending:
+                    yield from self._converted_rows(pending.popleft(), stats)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _converted_rows(future, stats):
+        t = time.perf_counter()
+        rows = future.result()
+        stats.process_seconds += time.perf_counter() - t
+        stats.rows += len(rows)
+        return rows
+
+    def _query_dataframe(self, linq_query, start, stop, parallel=None, window=None, type_dict=None, stats=None,
+                         mode='csv', cache=True):
+        """
+        Runs a query into a DataFrame, reusing results stored in
+        the result cache when the whole time range is in the past.
+        Queries with group clauses are not cached, as the groups of
+        windows queried separately can't be stitched together
+        """
+
+        def fetch(fetch_start, fetch_stop):
+            if parallel or window:
+                return self._parallel_dataframe(linq_query, fetch_start, fetch_stop, parallel, window, type_dict,
+                                                stats)
+            else:
+                return self._stream_dataframe(linq_query, fetch_start, fetch_stop, type_dict, stats, mode=mode)
+
+        if (not cache or self.result_cache is None or self._to_unix(stop) > self._to_unix('now')
+                or self._is_grouped(linq_query)):
+            return fetch(start, stop)
+
+        frames = self.result_cache.get(self._cache_key(linq_query, type_dict),
+                                       self._to_unix(start),
+                                       self._to_unix(stop),
+                                       fetch)
+
+        return self._concat_frames(frames)
+
+    def _is_grouped(self, linq_query):
+        return re.search(r'\bgroup\b', self._read_query(linq_query)) is not None
+
+    def _cache_key(self, linq_query, type_dict=None):
+        """
+        Identifies the results of a query for the result cache,
+        including the end point and credentials as results
+        depend on the domain being queried, and the timestamps
+        setting and types given as they change the DataFrame
+        """
+
+        query_text = SchemaCache.normalize(self._read_query(linq_query))
+        credential = self.api_key or self.oauth_token or self.jwt
+        types = json.dumps(type_dict, sort_keys=True) if type_dict is not None else ''
+
+        key = '\n'.join([self.end_point, credential, query_text, self.timestamps, types])
+
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _domain_key(self):
+        """
+        Identifies the end point and credentials queries are run
+        with, hashed so they can be stored in shared cache files
+        """
+
+        credential = self.api_key or self.oauth_token or self.jwt
+        key = '\n'.join([self.end_point, credential])
+
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _stream_dataframe(self, linq_query, start, stop, type_dict=None, stats=None, chunksize=None, mode='csv'):
+        """
+        Parses the csv stream in blocks straight into
+        typed columns instead of converting cell by cell
+
+        If chunksize is given returns a generator of DataFrames
+        with chunksize rows, the last one may be smaller
+        """
+
+        stats = stats or QueryStats()
+
+        if mode == 'csv':
+            type_dict, cols, lines = self._stream_lines(linq_query, start, stop, type_dict, stats)
+            read = read_dataframe
+        else:
+            type_dict, cols, lines = self._stream_json(linq_query, start, stop, mode, type_dict, stats)
+            read = json_dataframe
+
+        if chunksize is not None:
+            chunks = read(lines, cols, type_dict, chunksize, timestamps=self.timestamps)
+            return self._time_frames(chunks, stats)
+
+        t = time.perf_counter()
+        df = read(lines, cols, type_dict, timestamps=self.timestamps)
+        stats.process_seconds += time.perf_counter() - t
+        stats.rows += df.shape[0]
+
+        return df
+
+    def _query_columns(self, linq_query, start, stop, type_dict=None, stats=None, chunksize=2**16, mode='csv'):
+        """
+        Reads a query chunksize rows at a time into a dict of
+        arrays, dictionary encoding string columns as they arrive
+        so repeated values are only held once
+        """
+
+        stats = stats or QueryStats()
+
+        if mode == 'csv':
+            type_dict, cols, lines = self._stream_lines(linq_query, start, stop, type_dict, stats)
+            frames = read_dataframe(lines, cols, type_dict, chunksize, timestamps=self.timestamps)
+        else:
+            type_dict, cols, rows = self._stream_json(linq_query, start, stop, mode, type_dict, stats)
+            frames = json_dataframe(rows, cols, type_dict, chunksize, timestamps=self.timestamps)
+
+        t = time.perf_counter()
+        columns = read_columns(frames, cols, type_dict, self.max_categories)
+        stats.process_seconds += time.perf_counter() - t
+        stats.rows += len(columns[cols[0]]) if cols else 0
+
+        return columns
+
+    @staticmethod
+    def _time_frames(frames, stats):
+        clock = time.perf_counter
+        frames = iter(frames)
+
+        while True:
+            t = clock()
+            df = next(frames, None)
+            if df is None:
+                break
+            stats.process_seconds += clock() - t
+            stats.rows += df.shape[0]
+            yield df
+
+    def _stream_lines(self, linq_query, start, stop=None, type_dict=None, stats=None):
+        """
+        Starts a csv query and reads its header
+
+        :param type_dict: column types from a previous call to
+                          _get_types, probed if not given
+        :param stats: QueryStats in which timings and sizes are recorded
+        :return: column types, column names and a TextStream
+                 of the remaining csv rows
+        """
+
+        stats = stats or QueryStats()
+
+        if type_dict is None:
+            type_dict = self._timed_types(linq_query, start, stats)
 
+        t = time.perf_counter()
         result = self._query(linq_query, start, stop, mode = 'csv', stream = True)
-        result = self._decode_results(result)
+        first, lines = self._decode_results(result, stats)
 
-        reader = csv.reader(result)
-        cols = next(reader)
+        cols = next(csv.reader([first]))
+        stats.first_byte_seconds = time.perf_counter() - t
 
         assert len(cols) == len(type_dict), "Duplicate column names encountered, custom columns must be named"
 
-        type_list = [type_dict[c] for c in cols]
+        return type_dict, cols, lines
 
-        yield cols
+    def _stream_json(self, linq_query, start, stop, mode, type_dict=None, stats=None):
+        """
+        Starts a query in one of the json modes, whose
+        responses include the types of the columns
+
+        :param type_dict: column types used instead of
+                          those of the response if given
+        :return: column types, column names and an iterator
+                 of rows of json values
+        """
+
+        stats = stats or QueryStats()
+
+        t = time.perf_counter()
+        result = self._query(linq_query, start, stop, mode=mode, stream=True)
+        response_types, cols, rows = DECODERS[mode](TextStream(result, stats))
+        stats.first_byte_seconds = time.perf_counter() - t
+
+        if type_dict is None:
+            type_dict = response_types
+
+        return type_dict, cols, rows
+
+    def _stream_parallel(self, linq_query, start, stop, parallel=None, window=None, type_dict=None, stats=None):
+        """
+        yields column names then rows of all time windows in
+        time order.  Windows are buffered in memory until their
+        turn to be yielded
+        """
+
+        stats = stats or QueryStats()
+        shards = self._run_shards(self._fetch_rows, linq_query, start, stop, parallel, window, type_dict, stats)
+
+        for i, (shard, shard_stats) in enumerate(shards):
+            cols, rows = shard.result()
+            stats.add(shard_stats)
+            if i == 0:
+                yield cols
+            yield from rows
+
+    def _parallel_dataframe(self, linq_query, start, stop, parallel=None, window=None, type_dict=None, stats=None):
+        stats = stats or QueryStats()
+        shards = self._run_shards(self._stream_dataframe, linq_query, start, stop, parallel, window, type_dict,
+                                  stats)
+
+        frames = []
+        for shard, shard_stats in shards:
+            frames.append(shard.result())
+            stats.add(shard_stats)
+
+        return self._concat_frames(frames)
+
+    def _run_shards(self, fetch, linq_query, start, stop, parallel=None, window=None, type_dict=None, stats=None):
+        """
+        Splits [start, stop) into time windows that are queried
+        concurrently with fetch.  The schema is probed once and
+        shared by all windows.
+
+        :return: list of futures and the QueryStats of
+                 their window in time order
+        """
+
+        if type_dict is None:
+            type_dict = self._timed_types(linq_query, start, stats or QueryStats())
+        windows = self._make_windows(start, stop, parallel, window)
+
+        executor = ThreadPoolExecutor(max_workers=parallel or self.pool_size)
+        shards = []
+        for shard_start, shard_stop in windows:
+            shard_stats = QueryStats()
+            shards.append((executor.submit(fetch, linq_query, shard_start, shard_stop, type_dict, shard_stats),
+                           shard_stats))
+        executor.shutdown(wait=False)
+
+        return shards
+
+    def _fetch_rows(self, linq_query, start, stop, type_dict, stats=None):
+        results = self._stream(linq_query, start, stop, type_dict, stats)
+        cols = next(results)
+        return cols, list(results)
+
+    def _make_windows(self, start, stop, parallel=None, window=None):
+        """
+        Split [start, stop) into consecutive windows
+
+        :param parallel: number of windows of equal length
+        :param window: length of each window as seconds or a
+                       timedelta, takes precedence over parallel
+        :return: list of (start, stop) unix timestamps in seconds
+        """
+
+        start = self._to_unix(start)
+        stop = self._to_unix(stop)
 
-        for row in reader:
-            yield [t(v) for t, v in zip(type_list, row)]
+        # an empty range is queried as is, as it is without parallel
+        if start >= stop:
+            return [(start, stop)]
+
+        if window is None:
+            window = -(-(stop - start) // parallel)
+        elif isinstance(window, datetime.timedelta):
+            window = window.total_seconds()
+
+        window = max(int(window), 1)
+
+        bounds = list(range(start, stop, window)) + [stop]
+
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    @staticmethod
+    def _concat_frames(frames):
+        # empty shards have untyped columns that would upcast the others
+        non_empty = [df for df in frames if not df.empty]
+
+        if not non_empty:
+            return frames[0] if frames else pd.DataFrame()
+
+        return pd.concat(non_empty, ignore_index=True)
 
     def _query(self, linq_query, start, stop=None, mode='csv', stream=False, limit=None):
         """
@@ -111,12 +744,7 @@ class API(object):
         stop: End time of the query in the same format as start.
         Set stop to None for a continuous query
         """
-        if linq_query.endswith('.linq'):
-            with open(linq_query, 'r') as f:
-                query_text = f.read()
-        else:
-            query_text = linq_query
-
+        query_text = self._read_query(linq_query)
 
         if stop is None:
             stream = True
@@ -125,10 +753,23 @@ class API(object):
         r = self._make_request(query_text, start, stop, mode, stream, limit)
 
         if stream:
-            return r.iter_lines()
+            block_size = self.block_size if stop is not None else self.continuous_block_size
+            return r.iter_content(chunk_size=block_size)
         else:
             return r.text
 
+    @staticmethod
+    def _read_query(linq_query):
+        """
+        Returns the text of linq_query, reading it from
+        file if linq_query is the path to a .linq file
+        """
+        if linq_query.endswith('.linq'):
+            with open(linq_query, 'r') as f:
+                return f.read()
+        else:
+            return linq_query
+
     def _make_request(self, query_text, start, stop, mode, stream, limit):
 
 
@@ -176,7 +817,7 @@ class API(object):
         else:
             raise Exception('No credentials found')
 
-        r = requests.post(
+        r = self.session.post(
             self.end_point,
             data=body,
             headers=headers,
@@ -185,32 +826,41 @@ class API(object):
 
         return r
 
-    @staticmethod
-    def _null_decorator(f):
-        def null_f(v):
-            if v == '':
-                return None
-            else:
-                return f(v)
-        return null_f
-
     def _make_type_map(self):
+        self._map = csv_type_map(self.timestamps)
+        self._json_map = json_type_map(self.timestamps)
 
-        funcs = {
-                'timestamp': lambda t: datetime.datetime.strptime(t.strip(), '%Y-%m-%d %H:%M:%S.%f'),
-                'str': str,
-                'int8': int,
-                'int4': int,
-                'float8': float,
-                'float4': float,
-                'bool': lambda b: b == 'true'
-               }
-
-        self._map = defaultdict(lambda: str, {t:self._null_decorator(f) for t,f in funcs.items()})
+    def _timed_types(self, linq_query, start, stats):
+        t = time.perf_counter()
+        type_dict = self._get_types(linq_query, start)
+        stats.probe_seconds += time.perf_counter() - t
+        return type_dict
 
     def _get_types(self,linq_query,start):
         """
-        Gets types of each column of submitted
+        Gets the Devo type names of each column of submitted
+        query.  Use self._map to get the conversion functions
+
+        Types are read from the schema cache when possible
+        """
+
+        if self.schema_cache is not None:
+            query_text = self._read_query(linq_query)
+            type_dict = self.schema_cache.get(query_text, self._domain_key())
+            if type_dict is not None:
+                return type_dict
+
+        type_dict = self._probe_types(linq_query, start)
+
+        if self.schema_cache is not None:
+            self.schema_cache.put(query_text, type_dict, self._domain_key())
+
+        return type_dict
+
+    def _probe_types(self, linq_query, start):
+        """
+        Runs the query for one second and limit 1 to
+        find the types of its columns
         """
 
         # so we don't have  stop ts in future as required by API V2
@@ -227,7 +877,7 @@ class API(object):
 
         col_data = data['object']['m']
 
-        type_dict = { k:self._map[v['type']] for k,v in col_data.items() }
+        type_dict = { k:v['type'] for k,v in col_data.items() }
 
         return type_dict
 
@@ -246,7 +896,7 @@ class API(object):
         elif date == 'now':
             epoch = datetime.datetime.now().timestamp()
         elif type(date) == str:
-            epoch = pd.to_datetime(date).timestamp()
+            epoch = API._parse_date(date).timestamp()
         elif type(date) == datetime.datetime:
             epoch = date.replace(tzinfo=timezone.utc).timestamp()
         elif isinstance(date, (int,float)):
@@ -260,20 +910,41 @@ class API(object):
         return int(epoch)
 
     @staticmethod
-    def _decode_results(r):
-        r = iter(r)
+    def _parse_date(date):
+        """
+        Parse a date string as UTC, using fromisoformat for ISO
+        dates so pandas is only imported for other formats
+        """
+
+        try:
+            parsed = datetime.datetime.fromisoformat(date)
+        except ValueError:
+            return pd.to_datetime(date)
+
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+
+        return parsed
+
+    @staticmethod
+    def _decode_results(r, stats=None):
+        """
+        :param r: blocks of bytes of a response
+        :return: first line of the response and a
+                 TextStream of the rest of it
+        """
+
+        text = TextStream(r, stats)
+        first = text.readline()
 
         # catch error not reported for json
-        first = next(r)
         try:
             data = json.loads(first)
             check_status(data)
         except ValueError:
             pass
 
-        yield first.decode('utf-8').strip()  # APIV2 adding space to first line of aggregates
-        for l in r:
-            yield l.decode('utf-8')
+        return first.strip(), text  # APIV2 adding space to first line of aggregates
 
     @staticmethod
     def _to_list(results,cols):
@@ -290,59 +961,155 @@ class API(object):
         for row in results:
             yield Row(*row)
 
-    @staticmethod
-    def _to_dataframe(results,cols):
-        return pd.DataFrame(results, columns=cols).fillna(np.nan)
 
-    def randomSample(self,linq_query,start,stop,sample_size):
+    def randomSample(self, linq_query, start, stop, sample_size, method='bernoulli', table_size=None, max_rows=None):
+        """
+        Random sample of sample_size rows of a query as a DataFrame
+
+        :param method: 'bernoulli' filters rows server side with
+                       rand() so only about sample_size rows are
+                       downloaded.  'reservoir' streams every row and
+                       keeps a uniform sample, for continuous queries or
+                       queries that can't be counted
+        :param table_size: number of rows returned by the query, counted
+                           with an extra query if not given
+        :param max_rows: for reservoir sampling, stop after this many rows.
+                         Required for continuous queries
+        """
 
         if (sample_size < 1) or (not isinstance(sample_size, int)):
             raise Exception('Sample size must be a positive int')
-            
-        size_query = linq_query + ' group select count() as count'
 
-        r = self.query(size_query,start,stop,output='list')
-        table_size = next(r)[0]
+        if method == 'reservoir' or stop is None:
+            return self._reservoir_sample(linq_query, start, stop, sample_size, max_rows)
+
+        if table_size is None:
+            table_size = self._table_size(linq_query, start, stop)
 
         if sample_size >= table_size:
             warning_msg = 'Sample size greater than or equal to total table size. Returning full table'
             warnings.warn(warning_msg)
-            return self.query(linq_query,start,stop,output='dataframe')
+            return self.query(linq_query,start,stop,output='dataframe', cache=False)
 
         p = self._find_optimal_p(n=table_size,k=sample_size,threshold=0.99)
 
-        sample_query = linq_query + ' where simplify(float8(rand())) < {0} '.format(p)
+        # samples are not cached so every call draws a new one
+        df = self.query(self._sample_query(linq_query, p), start, stop, output='dataframe', cache=False)
 
-        while True:
-            df = self.query(sample_query,start,stop,output='dataframe')
+        if df.shape[0] >= sample_size:
+            return df.sample(sample_size).sort_index().reset_index(drop=True)
 
-            if df.shape[0] >= sample_size:
-                return df.sample(sample_size).sort_index().reset_index(drop=True)
-            else:
-                pass
+        return self._fill_sample(linq_query, start, stop, df, sample_size, table_size)
 
-    @staticmethod
-    def _loc_scale(n,p):
+    def _sample_query(self, linq_query, p):
+        return self._read_query(linq_query) + ' where simplify(float8(rand())) < {0} '.format(p)
+
+    def _table_size(self, linq_query, start, stop):
+        """
+        Number of rows returned by a query.  Counts of
+        historical queries are kept for later samples
         """
-        Takes parameters of a binomial
-        distribution and finds the mean
-        and std for a normal approximation
 
-        :param n: number of trials
-        :param p: probability of success
-        :return: mean, std
+        query_text = self._read_query(linq_query)
+        key = (SchemaCache.normalize(query_text), self._to_unix(start), self._to_unix(stop))
+
+        if key in self._table_sizes:
+            return self._table_sizes[key]
+
+        size_query = query_text + ' group select count() as count'
+
+        r = self.query(size_query,start,stop,output='list')
+        table_size = next(r)[0]
+
+        if self._to_unix(stop) <= self._to_unix('now'):
+            self._table_sizes[key] = table_size
+
+        return table_size
+
+    def _fill_sample(self, linq_query, start, stop, df, sample_size, table_size):
+        """
+        Draws the sample again when it came back short, each time
+        with a probability that is more likely to give enough rows.
+        Rows have no identity by which those already sampled could
+        be left out of a top up, so the whole sample is drawn again,
+        which keeps rows that are repeated in the query as likely to
+        be sampled as any other
+
+        After max_sample_draws short draws the largest is returned
+        with a warning, ie when table_size was larger than the query
+        """
+
+        for draw in range(1, self.max_sample_draws):
+            threshold = 1 - 0.01 / 10**draw
+            p = self._find_optimal_p(n=table_size, k=sample_size, threshold=threshold)
+
+            redraw = self.query(self._sample_query(linq_query, p), start, stop, output='dataframe', cache=False)
+
+            if redraw.shape[0] >= sample_size:
+                return redraw.sample(sample_size).sort_index().reset_index(drop=True)
+
+            if redraw.shape[0] > df.shape[0]:
+                df = redraw
+
+        warning_msg = 'Sampled {0} of {1} rows, the query may have fewer than {2} rows'.format(
+            df.shape[0], sample_size, table_size)
+        warnings.warn(warning_msg)
+
+        return df.reset_index(drop=True)
+
+    def _reservoir_sample(self, linq_query, start, stop, sample_size, max_rows=None):
+        """
+        Uniform sample of sample_size rows from a single pass over
+        the query, using Algorithm L to skip over rows that won't be
+        sampled.  Skipped rows are parsed but their values are not
+        converted.  Rows are returned in the order of the query
         """
-        loc = n*p
-        scale = np.sqrt(n*p*(1-p))
 
-        return loc,scale
+        assert not (stop is None and max_rows is None), "max_rows must be set to sample a continuous query"
+
+        type_dict, cols, lines = self._stream_lines(linq_query, start, stop)
+        rows = csv.reader(lines)
+
+        if max_rows is not None:
+            rows = itertools.islice(rows, max_rows)
+
+        reservoir = list(enumerate(itertools.islice(rows, sample_size)))
+
+        if len(reservoir) < sample_size:
+            warning_msg = 'Sample size greater than or equal to total table size. Returning full table'
+            warnings.warn(warning_msg)
+        else:
+            position = sample_size - 1
+            w = math.exp(math.log(1 - random.random()) / sample_size)
+
+            while True:
+                skip = math.floor(math.log(1 - random.random()) / math.log(1 - w)) if w < 1 else 0
+                row = next(itertools.islice(rows, skip, None), None)
+                if row is None:
+                    break
+
+                position += skip + 1
+                reservoir[random.randrange(sample_size)] = (position, row)
+                w *= math.exp(math.log(1 - random.random()) / sample_size)
+
+        reservoir.sort(key=lambda item: item[0])
+
+        type_list = [self._map[type_dict[c]] for c in cols]
+        data = [[t(v) for t, v in zip(type_list, row)] for _, row in reservoir]
+
+        return pd.DataFrame(data, columns=cols).fillna(np.nan)
 
     def _find_optimal_p(self,n,k,threshold):
         """
         Use a normal approximation to the
-        binomial distribution.  Starts with
-        p such that mean of B(n,p) = k
-        and iterates.
+        binomial distribution and solve for
+        the smallest p such that B(n,p) has
+        at least k successes with probability
+        threshold.
+
+        With z = norm.ppf(threshold) and c = k - 0.5
+        (continuity correction) p solves
+        n*p - c = z * sqrt(n*p*(1-p)), a quadratic in p
 
         :param n: number of trials
         :param k: desired number of successes
@@ -352,42 +1119,112 @@ class API(object):
                  k success with n trials with probability of threshold
 
         """
-        p = k / n
-        while True:
-            loc, scale = self._loc_scale(n, p)
-            # sf = 1 - cdf, but can be more accurate according to scipy docs
-            if norm.sf(x=k - 0.5, loc=loc, scale=scale) > threshold:
-                break
-            else:
-                p = min(1.001*p, 1)
+        # scipy is only needed here so it is imported on first use
+        from scipy.stats import norm
+
+        z = norm.ppf(threshold)
+        c = k - 0.5
 
-        return p
+        a = n*n + z*z*n
+        b = 2*c*n + z*z*n
 
-    def randomSampleColumn(self):
+        p = (b + math.sqrt(b*b - 4*a*c*c)) / (2*a)
+
+        return min(p, 1)
+
+    def randomSampleColumn(self, linq_query, start, stop, column, sample_size, keys_per_query=500):
+        """
+        Samples sample_size distinct values of column (ie phone
+        number) among the rows of a query, and returns every row
+        of the query with one of the sampled values as a DataFrame
+
+        Distinct values are counted and sampled server side, so only
+        about sample_size values are downloaded.  The rows of the
+        sampled values are then queried in chunks of keys_per_query
+        values that run concurrently
+
+        :param column: name of the column to sample by
+        :param keys_per_query: number of sampled values filtered
+                               for in each query of rows
         """
-        specify a linq query
-        and specify a column to sample by
-        and specify number of distinct values
 
-        ie sample by phone number
+        if (sample_size < 1) or (not isinstance(sample_size, int)):
+            raise Exception('Sample size must be a positive int')
+
+        assert stop is not None, "Can't sample a continuous query by column"
+
+        query_text = self._read_query(linq_query)
+        type_dict = self._get_types(query_text, start)
+
+        assert column in type_dict, "{0} is not a column of the query".format(column)
+
+        key_query = query_text + ' group by {0}'.format(column)
+        num_keys = self._table_size(key_query, start, stop)
 
-        find all distinct phone numbers that
-        meet the filter/where clause and time range
-        in the linq / start + stop times provided
-        (con't be con't query)
+        if sample_size >= num_keys:
+            warning_msg = 'Sample size greater than or equal to number of distinct values. Returning full table'
+            warnings.warn(warning_msg)
+            return self.query(query_text, start, stop, output='dataframe', types=type_dict, cache=False)
+
+        keys = set()
+        while len(keys) < sample_size:
+            shortfall = sample_size - len(keys)
+            p = self._find_optimal_p(n=num_keys - len(keys), k=shortfall, threshold=0.99)
+
+            # keys are kept as the csv text Devo sent, from which their literals are built
+            _, cols, lines = self._stream_lines(self._sample_query(key_query, p), start, stop)
+            index = cols.index(column)
+            new_keys = {row[index] for row in csv.reader(lines)} - keys
 
-        random pick distinct phone numbers based on
-        specified distinc values
+            keys.update(random.sample(list(new_keys), min(shortfall, len(new_keys))))
 
-        run specified linq query but filter to only
-        rows that have selected phone numbers
+        filters = [self._key_filter(column, type_dict[column], chunk)
+                   for chunk in self._chunks(sorted(keys), keys_per_query)]
 
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            frames = list(executor.map(lambda f: self._stream_dataframe(query_text + f, start, stop, type_dict),
+                                       filters))
 
-        :return:
+        return self._concat_frames(frames)
+
+    @staticmethod
+    def _chunks(values, size):
+        for i in range(0, len(values), size):
+            yield values[i:i + size]
+
+    @staticmethod
+    def _key_filter(column, type_name, keys):
+        """
+        LINQ where clause keeping rows whose column equals
+        one of keys, given as the text of their csv cells.
+        Numbers and booleans are compared as literals, timestamps
+        as the timestamp of their text and other types by their
+        string representation.  Empty cells are nulls, or empty
+        strings for str columns
         """
 
-        pass
+        conditions = []
+
+        for key in keys:
+            literal = '"{0}"'.format(key.replace('\\', '\\\\').replace('"', '\\"'))
+
+            if key == '':
+                condition = 'isnull({0})'.format(column)
+                if type_name == 'str':
+                    condition = '({0} or {1} = "")'.format(condition, column)
+                conditions.append(condition)
+            elif type_name in ('int8', 'int4', 'float8', 'float4'):
+                conditions.append('{0} = {1}'.format(column, key))
+            elif type_name == 'bool':
+                conditions.append('{0} = {1}'.format(column, key.lower()))
+            elif type_name == 'timestamp':
+                conditions.append('{0} = timestamp({1})'.format(column, literal))
+            elif type_name == 'str':
+                conditions.append('{0} = {1}'.format(column, literal))
+            else:
+                conditions.append('str({0}) = {1}'.format(column, literal))
 
+        return ' where ' + ' or '.join(conditions)
 
 
 
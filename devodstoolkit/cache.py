@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from .lazy import lazy_import
+
+pd = lazy_import('pandas', globals(), 'pd')
+
+
+class SchemaCache(object):
+    """
+    LRU cache of the column types found by the schema
+    probe of API._get_types, keyed on the normalized text
+    of the query and the domain it was run in, as the same
+    query can have other columns in another domain
+
+    Entries older than ttl seconds are probed again.
+    If path is given the cache is also persisted to
+    that file so it can be reused between processes
+    """
+
+    def __init__(self, max_size=256, ttl=24*60*60, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = os.path.expanduser(path) if path else None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.path and os.path.exists(self.path):
+            self._read_file()
+
+    @staticmethod
+    def normalize(query_text):
+        return ' '.join(query_text.split())
+
+    def _key(self, query_text, domain):
+        key = self.normalize(query_text)
+        return key if domain is None else domain + '\n' + key
+
+    def get(self, query_text, domain=None):
+        """
+        :param domain: identifies where the query is run,
+                       ie a hash of the end point and credentials
+        :return: dict of column names to Devo types or
+                 None if the query is not in the cache
+        """
+
+        key = self._key(query_text, domain)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            created, type_dict = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+        return dict(type_dict)
+
+    def put(self, query_text, type_dict, domain=None):
+        key = self._key(query_text, domain)
+
+        with self._lock:
+            self._entries[key] = (time.time(), dict(type_dict))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+            if self.path:
+                self._write_file()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+            if self.path:
+                self._write_file()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read_file(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except ValueError:
+            # corrupt cache files are ignored and overwritten
+            return
+
+        for key, (created, type_dict) in entries.items():
+            self._entries[key] = (created, type_dict)
+
+    def _write_file(self):
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+
+        os.replace(tmp_path, self.path)
+
+
+class ResultCache(object):
+    """
+    Size bounded on disk cache of DataFrames returned by
+    historical queries, keyed on the query and its time window
+
+    When a query overlaps windows that were already cached
+    only the missing sub-ranges are queried.  Cached windows
+    are only reused when they are fully contained in the
+    requested range, so only queries whose rows can be split
+    by time should be cached.  API skips queries with group
+    clauses and those run with cache=False
+    """
+
+    def __init__(self, path='~/.devo_result_cache', max_bytes=2**30):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        # key -> list of [start, stop, file name, size in bytes, last used]
+        self._index = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self._index_path = os.path.join(self.path, 'index.json')
+
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as f:
+                self._index = json.load(f)
+            # max_bytes may be smaller than when the cache was written
+            self._evict()
+
+    @property
+    def size(self):
+        return sum(segment[3] for segments in self._index.values() for segment in segments)
+
+    def get(self, key, start, stop, fetch):
+        """
+        Get the results of a query between start and stop,
+        calling fetch for every sub-range that is not cached
+
+        :param key: identifies the query
+        :param start: unix timestamp in seconds
+        :param stop: unix timestamp in seconds
+        :param fetch: function of start and stop returning a DataFrame
+        :return: list of DataFrames in time order
+        """
+
+        with self._lock:
+            cached, missing = self._plan(key, start, stop)
+
+        frames = []
+
+        for segment in cached:
+            try:
+                df = pd.read_pickle(os.path.join(self.path, segment[2]))
+            except FileNotFoundError:
+                # evicted by another thread since planning
+                missing.append(segment[:2])
+                continue
+            frames.append((segment[0], df))
+            self.stats['hits'] += 1
+
+        for window_start, window_stop in missing:
+            df = fetch(window_start, window_stop)
+            frames.append((window_start, df))
+            self.stats['misses'] += 1
+
+            with self._lock:
+                self._put(key, window_start, window_stop, df)
+
+        frames.sort(key=lambda frame: frame[0])
+
+        return [df for _, df in frames]
+
+    def clear(self):
+        with self._lock:
+            for segments in self._index.values():
+                for segment in segments:
+                    self._remove_file(segment[2])
+            self._index = {}
+            self._write_index()
+
+    def _plan(self, key, start, stop):
+        """
+        Choose cached windows contained in [start, stop)
+        and find the gaps between them
+
+        :return: list of cached segments, list of missing (start, stop)
+        """
+
+        segments = [segment for segment in self._index.get(key, [])
+                    if segment[0] >= start and segment[1] <= stop]
+        segments.sort(key=lambda segment: (segment[0], -segment[1]))
+
+        cached = []
+        missing = []
+        cursor = start
+
+        for segment in segments:
+            if segment[0] < cursor:
+                continue
+            if segment[0] > cursor:
+                missing.append((cursor, segment[0]))
+            segment[4] = time.time()
+            cached.append(segment)
+            cursor = segment[1]
+
+        if cursor < stop:
+            missing.append((cursor, stop))
+
+        return cached, missing
+
+    def _put(self, key, start, stop, df):
+        file_name = uuid.uuid4().hex + '.pkl'
+        file_path = os.path.join(self.path, file_name)
+
+        df.to_pickle(file_path)
+        size = os.path.getsize(file_path)
+
+        self._index.setdefault(key, []).append([start, stop, file_name, size, time.time()])
+
+        self._evict()
+        self._write_index()
+
+    def _evict(self):
+        segments = [(segment[4], key, segment) for key, segments in self._index.items() for segment in segments]
+        segments.sort(key=lambda segment: segment[0])
+
+        total = sum(segment[3] for _, _, segment in segments)
+
+        for _, key, segment in segments:
+            if total <= self.max_bytes:
+                break
+
+            self._index[key].remove(segment)
+            if not self._index[key]:
+                del self._index[key]
+
+            self._remove_file(segment[2])
+            total -= segment[3]
+            self.stats['evictions'] += 1
+
+    def _remove_file(self, file_name):
+        try:
+            os.remove(os.path.join(self.path, file_name))
+        except FileNotFoundError:
+            pass
+
+    def _write_index(self):
+        tmp_path = self._index_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+
+        os.replace(tmp_path, self._index_path)
@@ -0,0 +1,381 @@
+import io
+import time
+import codecs
+import itertools
+
+from .timestamps import convert_timestamps, convert_ms_timestamps
+from .lazy import lazy_import
+
+np = lazy_import('numpy', globals(), 'np')
+pd = lazy_import('pandas', globals(), 'pd')
+
+# types whose empty cells are nulls, matching API._make_type_map
+NULLABLE_TYPES = ('timestamp', 'str', 'int8', 'int4', 'float8', 'float4', 'bool')
+
+# dtypes handed to the C parser, anything else is read as str and converted afterwards
+READ_DTYPES = {
+    'int8': 'Int64',
+    'int4': 'Int64',
+    'float8': 'float64',
+    'float4': 'float64'
+}
+
+
+class TextStream(object):
+    """
+    Incrementally decodes a response read in large blocks of
+    bytes, without splitting it into lines first
+
+    Can be read as a file by pandas.read_csv, or iterated over
+    as lines ending in their newline by csv.reader so quoted
+    fields with newlines, or that span blocks, are kept whole
+    """
+
+    def __init__(self, blocks, stats=None):
+        self.blocks = iter(blocks)
+        self.stats = stats
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.done = False
+
+    def _next_text(self):
+        """
+        :return: text of the next non empty block or None at the end
+        """
+
+        clock = time.perf_counter
+
+        while not self.done:
+            t = clock()
+            block = next(self.blocks, None)
+            t_read = clock()
+
+            if block is None:
+                self.done = True
+                text = self.decoder.decode(b'', final=True)
+            else:
+                text = self.decoder.decode(block)
+
+            if self.stats is not None:
+                self.stats.read_seconds += t_read - t
+                self.stats.decode_seconds += clock() - t_read
+                self.stats.bytes += len(block or b'')
+
+            if text:
+                return text
+
+        return None
+
+    def readline(self):
+        parts = [self.buffer]
+
+        while '\n' not in parts[-1]:
+            text = self._next_text()
+            if text is None:
+                break
+            parts.append(text)
+
+        data = ''.join(parts)
+        end = data.find('\n') + 1 or len(data)
+        self.buffer = data[end:]
+
+        return data[:end]
+
+    def read(self, size=-1):
+        """
+        Returns the buffered text or the next block, so reads
+        may be shorter or longer than size.  '' at the end
+        """
+
+        if size is not None and size < 0:
+            parts = [self.buffer] + list(iter(self._next_text, None))
+            self.buffer = ''
+            return ''.join(parts)
+
+        return self.read_block()
+
+    def read_block(self):
+        """
+        :return: the buffered text or the text of the next
+                 block, '' at the end
+        """
+
+        if self.buffer:
+            data, self.buffer = self.buffer, ''
+            return data
+
+        return self._next_text() or ''
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._line_blocks())
+
+    def _line_blocks(self):
+        """
+        Yields the complete lines of every block, each split by
+        StringIO in C, carrying a partial last line to the next block
+        """
+
+        carry = [self.buffer]
+        self.buffer = ''
+
+        while True:
+            text = self._next_text()
+            if text is None:
+                break
+
+            end = text.rfind('\n') + 1
+            if not end:
+                carry.append(text)
+                continue
+
+            carry.append(text[:end])
+            yield io.StringIO(''.join(carry), newline='')
+            carry = [text[end:]]
+
+        rest = ''.join(carry)
+        if rest:
+            yield io.StringIO(rest, newline='')
+
+
+def is_string_type(type_name):
+    # types without a conversion are returned as the text received
+    return type_name == 'str' or type_name not in NULLABLE_TYPES
+
+
+def read_dataframe(lines, cols, type_dict, chunksize=None, timestamps='datetime'):
+    """
+    Parse csv rows (without the header) into a DataFrame
+    with typed columns
+
+    :param lines: TextStream or file of the csv rows
+    :param cols: column names in the order of the csv
+    :param type_dict: maps column names to Devo type names
+    :param chunksize: if given return an iterator of DataFrames
+                      with at most chunksize rows each
+    :param timestamps: representation of timestamp columns, see convert_timestamps
+    :return: DataFrame or iterator of DataFrames
+    """
+
+    dtypes = {c: READ_DTYPES.get(type_dict[c], str) for c in cols}
+    na_values = {c: [''] for c in cols if type_dict[c] in NULLABLE_TYPES}
+
+    reader = pd.read_csv(lines,
+                         header=None,
+                         names=cols,
+                         dtype=dtypes,
+                         na_values=na_values,
+                         keep_default_na=False,
+                         chunksize=chunksize)
+
+    if chunksize is None:
+        return convert_dataframe(reader, type_dict, timestamps)
+    else:
+        return (convert_dataframe(df, type_dict, timestamps) for df in reader)
+
+
+def json_dataframe(rows, cols, type_dict, chunksize=None, timestamps='datetime'):
+    """
+    Build a DataFrame from the rows of a json mode response
+    with the same types as read_dataframe
+
+    :param rows: iterable of lists of json values
+    :param chunksize: if given return an iterator of DataFrames
+                      with at most chunksize rows each
+    """
+
+    if chunksize is None:
+        return convert_json_rows(list(rows), cols, type_dict, timestamps)
+
+    rows = iter(rows)
+    chunks = iter(lambda: list(itertools.islice(rows, chunksize)), [])
+
+    return (convert_json_rows(chunk, cols, type_dict, timestamps) for chunk in chunks)
+
+
+def read_columns(frames, cols, type_dict, max_categories=2**15):
+    """
+    Collect DataFrame chunks into a dict of arrays keyed by
+    column name.  String columns are dictionary encoded into a
+    pandas.Categorical as the chunks arrive, unless they have
+    more than max_categories distinct values
+
+    :param frames: iterator of DataFrames from read_dataframe or json_dataframe
+    :return: dict of numpy arrays, Categoricals and string arrays
+    """
+
+    encoders = {c: DictionaryEncoder(max_categories) for c in cols if is_string_type(type_dict[c])}
+    parts = {c: [] for c in cols if c not in encoders}
+
+    for df in frames:
+        # empty chunks are untyped
+        if df.empty:
+            continue
+        for c, encoder in encoders.items():
+            encoder.add(df[c])
+        for c, part in parts.items():
+            part.append(df[c])
+
+    columns = {}
+    for c in cols:
+        if c in encoders:
+            columns[c] = encoders[c].result()
+        elif parts[c]:
+            # concatenated as pandas does for the chunks of a DataFrame, ie ints become floats with nulls
+            columns[c] = column_array(parts[c])
+        else:
+            columns[c] = np.array([], dtype=object)
+
+    return columns
+
+
+def column_array(parts):
+    """
+    :param parts: Series of the chunks of a column
+    :return: numpy array of the column, or the pandas
+             array of dtypes numpy can't represent
+    """
+
+    s = pd.concat(parts, ignore_index=True)
+
+    if isinstance(s.dtype, np.dtype):
+        return s.to_numpy()
+
+    return s.array
+
+
+class DictionaryEncoder(object):
+    """
+    Encodes the chunks of a string column as codes into one
+    table of the distinct values seen so far.  Once there are
+    more than max_categories values the column is kept as
+    strings instead
+    """
+
+    def __init__(self, max_categories=2**15):
+        self.max_categories = max_categories
+        self.index = {}
+        self.codes = []
+        self.values = None
+
+    def add(self, s):
+        """
+        :param s: Series of strings, nulls as NaN
+        """
+
+        if self.values is not None:
+            self.values.append(s)
+            return
+
+        codes, uniques = pd.factorize(s)
+
+        # the last entry maps the null code -1 to itself
+        mapping = [self.index.setdefault(u, len(self.index)) for u in uniques.tolist()] + [-1]
+        mapping = np.array(mapping, dtype=np.int32)
+        self.codes.append(mapping[codes])
+
+        if len(self.index) > self.max_categories:
+            values = np.array(list(self.index) + [np.nan], dtype=object)
+            self.values = [pd.Series(values[codes]) for codes in self.codes]
+            self.codes = None
+
+    def result(self):
+        """
+        :return: Categorical of the column, or an array
+                 of strings if it had too many values
+        """
+
+        if self.values is not None:
+            return column_array(self.values)
+
+        codes = np.concatenate(self.codes) if self.codes else np.array([], dtype=np.int32)
+
+        return pd.Categorical.from_codes(codes, categories=list(self.index))
+
+
+def convert_json_rows(rows, cols, type_dict, timestamps='datetime'):
+    if not rows:
+        return pd.DataFrame(columns=cols)
+
+    columns = zip(*rows)
+
+    return pd.DataFrame({c: convert_json_column(pd.Series(values, dtype=object), type_dict[c], timestamps)
+                         for c, values in zip(cols, columns)},
+                        columns=cols)
+
+
+def convert_json_column(s, type_name, timestamps='datetime'):
+    """
+    convert_column for a column of json values, nulls as None
+    """
+
+    if type_name not in NULLABLE_TYPES:
+        return s.where(s.notna(), '').astype(str)
+
+    s = s.where(s.notna() & (s != ''), np.nan)
+
+    if type_name in ('int8', 'int4'):
+        return convert_column(pd.to_numeric(s), type_name, timestamps)
+
+    elif type_name in ('float8', 'float4'):
+        return pd.to_numeric(s).astype('float64')
+
+    elif type_name == 'bool':
+        mask = s.isna().to_numpy()
+        values = (s.to_numpy() == True) | (s.to_numpy() == 'true')
+        if mask.any():
+            values = values.astype(object)
+            values[mask] = np.nan
+        return pd.Series(values, index=s.index)
+
+    elif type_name == 'timestamp':
+        values = s.dropna()
+        if len(values) and isinstance(values.iloc[0], str):
+            return convert_timestamps(s, timestamps)
+        return convert_ms_timestamps(s, timestamps)
+
+    # let pandas infer the string dtype it gives csv columns read as str
+    inferred = pd.Series(s.to_numpy(), index=s.index)
+
+    return s if inferred.dtype.kind == 'f' else inferred
+
+
+def convert_dataframe(df, type_dict, timestamps='datetime'):
+    """
+    Convert the columns of a DataFrame read as raw csv to
+    the types built by the row based path of API.query
+    """
+
+    if df.empty:
+        return pd.DataFrame(columns=df.columns)
+
+    for col in df.columns:
+        df[col] = convert_column(df[col], type_dict[col], timestamps)
+
+    return df
+
+
+def convert_column(s, type_name, timestamps='datetime'):
+    """
+    Vectorized equivalent of the conversions in API._make_type_map
+    applied to a whole column.  Nulls are represented the same way
+    pandas represents them when building a frame from python rows
+    """
+
+    if type_name in ('int8', 'int4'):
+        if s.hasnans:
+            return s.astype('float64')
+        else:
+            return s.astype('int64')
+
+    elif type_name == 'bool':
+        mask = s.isna()
+        values = (s == 'true').to_numpy()
+        if mask.any():
+            values = values.astype(object)
+            values[mask.to_numpy()] = np.nan
+        return pd.Series(values, index=s.index)
+
+    elif type_name == 'timestamp':
+        return convert_timestamps(s, timestamps)
+
+    return s
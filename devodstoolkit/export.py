@@ -0,0 +1,107 @@
+import csv
+
+
+ARROW_FORMATS = ('parquet', 'arrow')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError('pyarrow is required to write parquet and arrow files: pip install pyarrow')
+
+    return pyarrow
+
+
+def arrow_schema(cols, type_dict, timestamps='datetime'):
+    """
+    Arrow schema of a query built from the Devo types
+    of its columns, so that every chunk of the results is
+    written with the same types whether or not it has nulls
+    """
+
+    pa = _import_pyarrow()
+
+    if timestamps == 'epoch_ms':
+        timestamp_type = pa.int64()
+    else:
+        timestamp_type = pa.timestamp('us')
+
+    arrow_types = {
+        'timestamp': timestamp_type,
+        'int8': pa.int64(),
+        'int4': pa.int64(),
+        'float8': pa.float64(),
+        'float4': pa.float64(),
+        'bool': pa.bool_()
+    }
+
+    return pa.schema([(c, arrow_types.get(type_dict[c], pa.string())) for c in cols])
+
+
+def write_arrow(chunks, path, schema, file_format='parquet'):
+    """
+    Write DataFrames to a parquet or arrow ipc file as
+    they are produced, one row group or record batch per
+    DataFrame, so only one chunk is held in memory
+
+    :param chunks: iterable of DataFrames with the columns of schema
+    """
+
+    pa = _import_pyarrow()
+
+    if file_format == 'parquet':
+        writer = pa.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+
+    with writer:
+        for df in chunks:
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+
+
+def write_csv(cols, text, path):
+    """
+    Write the raw csv text of a query to file
+    without parsing it
+
+    :param text: TextStream of the csv rows
+    :return: number of rows written, not counting the header
+    """
+
+    rows = 0
+    quoted = False
+    last = '\n'
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f, lineterminator='\n').writerow(cols)
+        for block in iter(text.read_block, ''):
+            f.write(block)
+            rows += _row_ends(block, quoted)
+            # escaped quotes are doubled so they don't change whether a field is open
+            quoted ^= block.count('"') % 2 == 1
+            last = block[-1]
+
+    # a last row without a newline
+    if last != '\n':
+        rows += 1
+
+    return rows
+
+
+def _row_ends(block, quoted):
+    """
+    :param quoted: whether block starts inside a quoted field
+    :return: number of newlines in block that end a row,
+             those not inside quoted fields
+    """
+
+    if '"' not in block:
+        return 0 if quoted else block.count('\n')
+
+    parts = block.split('"')
+    outside = parts[1::2] if quoted else parts[0::2]
+
+    return sum(part.count('\n') for part in outside)
@@ -0,0 +1,46 @@
+import sys
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is
+    first used, then imports it and replaces itself in the
+    globals of the module that created it, so later uses
+    look up the real module without going through the proxy
+
+    Used for numpy and pandas, which take most of the time
+    of importing the package but are only needed for
+    DataFrames and sampling
+    """
+
+    def __init__(self, name, parent_globals, local_name):
+        super().__init__(name)
+        self._parent_globals = parent_globals
+        self._local_name = local_name
+
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        self._parent_globals[self._local_name] = module
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, item):
+        return getattr(self._load(), item)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name, parent_globals, local_name):
+    """
+    :return: the module if it is already imported,
+             otherwise a LazyModule for it
+    """
+
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    return LazyModule(name, parent_globals, local_name)
@@ -4,16 +4,61 @@ import socket
 import ssl
 import sys
 import csv
-import numpy as np
-from collections import abc
+import json
+import time
+import queue
+import threading
+import itertools
+from collections import abc, deque
 from contextlib import contextmanager
+from .stats import LoadStats
+from .spool import Spool
+from .lazy import lazy_import
+
+np = lazy_import('numpy', globals(), 'np')
+pd = lazy_import('pandas', globals(), 'pd')
 
 csv.field_size_limit(sys.maxsize)
 
+# 'indices' messages are the comma separated start of every column followed
+# by <> and the payload.  'compact' messages start with COMPACT_VERSION and
+# the number of digits of the offsets, followed by the zero padded start of
+# every column but the first and then the payload
+MESSAGE_FORMATS = ('indices', 'compact')
+COMPACT_VERSION = '2'
+
+
+class FileLines(object):
+    """
+    Iterates the decoded lines of a file opened in binary
+    mode from offset, keeping the byte offset of the next line
+    """
+
+    def __init__(self, f, offset=0):
+        f.seek(offset)
+        self.f = f
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.f)
+        self.offset += len(line)
+        return line.decode('utf-8')
+
 
 class Loader:
 
-    def __init__(self, profile='default', key=None, crt=None, chain=None, relay=None, timeout=2):
+    # rows of a DataFrame encoded at once by load_df
+    df_chunk_rows = 2**14
+    # size of the reads from files loaded by load_file
+    file_buffer_bytes = 2**20
+
+    def __init__(self, profile='default', key=None, crt=None, chain=None, relay=None, timeout=2, batch_bytes=2**16,
+                 hooks=None, message_format='indices', spool=None):
+
+        assert message_format in MESSAGE_FORMATS, "message_format must be in {0}".format(MESSAGE_FORMATS)
 
         self.profile = profile
         self.key = key
@@ -23,6 +68,12 @@ class Loader:
 
         self.sock = None
         self.timeout = timeout
+        self.batch_bytes = batch_bytes
+        self.message_format = message_format
+
+        # functions called with the LoadStats of each load once it completes
+        self.hooks = list(hooks or [])
+        self.load_stats = None
 
         if not all([key, crt, chain, relay]):
             self._read_profile()
@@ -32,6 +83,32 @@ class Loader:
 
         self.address = (self.relay, 443)
 
+        # loads are written to the spool and sent to the relay in the background
+        self.spool = Spool(spool, self._open_socket) if spool is not None else None
+
+    @property
+    def spool_stats(self):
+        return self.spool.stats if self.spool is not None else None
+
+    def drain(self, timeout=None):
+        """
+        Waits until every row spooled has been sent to the relay
+
+        :return: True if the spool is empty, False on timeout
+        """
+
+        assert self.spool is not None, "The Loader has no spool"
+
+        return self.spool.drain(timeout)
+
+    def close(self):
+        """
+        Stops sending the spool, rows not yet sent stay in it
+        """
+
+        if self.spool is not None:
+            self.spool.close()
+
     def _read_profile(self):
 
         config = configparser.ConfigParser()
@@ -49,32 +126,41 @@ class Loader:
     @contextmanager
     def _connect_socket(self):
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(self.timeout)
+        self.sock = self._open_socket()
 
-        self.sock = ssl.wrap_socket(self.sock,
-                                    keyfile=self.key,
-                                    certfile=self.crt,
-                                    ca_certs=self.chain,
-                                    cert_reqs=ssl.CERT_REQUIRED)
+        try:
+            yield None
+        finally:
+            self.sock.close()
+            self.sock = None
 
-        self.sock.connect(self.address)
+    def _open_socket(self):
 
-        yield None
-        self.sock.close()
-        self.sock = None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+
+        sock = ssl.wrap_socket(sock,
+                               keyfile=self.key,
+                               certfile=self.crt,
+                               ca_certs=self.chain,
+                               cert_reqs=ssl.CERT_REQUIRED)
+
+        sock.connect(self.address)
+
+        return sock
+
+    def load_file(self, file_path, tag, historical=True, ts_index=None, ts_name=None, header=False, columns=None,
+                  connections=1, checkpoint=None, retries=0, progress=None):
 
-    def load_file(self, file_path, tag, historical=True, ts_index=None, ts_name=None, header=False, columns=None):
+        assert connections == 1 or checkpoint is None, "Checkpoints can only be used with a single connection"
 
-        with self._connect_socket() as _, open(file_path, 'r') as f:
-            data = csv.reader(f)
-            first = next(data)
+        with open(file_path, 'rb', buffering=self.file_buffer_bytes) as f:
+            lines = FileLines(f)
+            first = next(csv.reader(lines))
 
             if historical:
-                chunk_size = 50
                 num_cols = len(first) - 1
             else:
-                chunk_size = 1
                 num_cols = len(first)
 
             if header:
@@ -82,23 +168,113 @@ class Loader:
                     columns = first
                 if ts_name is not None:
                     ts_index = columns.index(ts_name)
+                offset = lines.offset
             else:
-                f.seek(0)
+                offset = 0
+
+            stats = self._start_stats(tag)
+            if connections > 1:
+                self._load(csv.reader(FileLines(f, offset)), tag, historical, ts_index, connections, stats)
+            else:
+                self._load_resumable(f, offset, tag, historical, ts_index, checkpoint, retries, progress, stats)
+            self._finish_stats(stats)
+
+        self._build_linq(tag, num_cols, columns, self.message_format)
+
+    def _load_resumable(self, f, offset, tag, historical, ts_index, checkpoint=None, retries=0, progress=None,
+                        stats=None):
+        """
+        Loads the csv rows of f starting at byte offset, keeping
+        track of the offset and number of rows of the last
+        batch sent.  After a connection error the load is resumed
+        from there up to retries times.
+
+        If checkpoint is the path of a file the position is saved to it,
+        at most once a second and on failure, and a load of the same
+        file resumes from a saved position.  The file is removed once
+        the load completes.  Rows sent after the last save may be sent
+        again when resuming.
+
+        :param progress: function called with the LoadStats of the
+                         load after every batch
+        """
+
+        stats = stats or LoadStats(tag)
+        stats.rows = 0
+
+        file_info = {'file': os.path.abspath(f.name), 'size': os.fstat(f.fileno()).st_size}
+        position = {'offset': offset, 'rows': 0}
+
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint, 'r') as cp:
+                saved = json.load(cp)
+            if saved['file'] != file_info['file'] or saved['size'] != file_info['size']:
+                raise Exception('Checkpoint {0} is for a different file'.format(checkpoint))
+            position = {'offset': saved['offset'], 'rows': saved['rows']}
+
+        def save():
+            if checkpoint:
+                self._write_checkpoint(checkpoint, dict(file_info, **position))
+
+        start_rows = position['rows']
+        last_save = time.time()
+        attempt = 0
+
+        while True:
+            lines = FileLines(f, position['offset'])
+            rows = [position['rows']]
+
+            def count(data):
+                for row in data:
+                    rows[0] += 1
+                    yield row
+
+            def on_sent(batch):
+                nonlocal last_save
+                position['offset'] = lines.offset
+                position['rows'] = rows[0]
+
+                stats.offset = position['offset']
+                stats.rows = position['rows'] - start_rows
+                if progress is not None:
+                    progress(stats)
+
+                now = time.time()
+
+                if now - last_save >= 1:
+                    save()
+                    last_save = now
+
+            try:
+                self._send(self._batches(count(csv.reader(lines)), tag, historical, ts_index), on_sent=on_sent,
+                           stats=stats)
+                break
+            except OSError:
+                save()
+                if attempt >= retries:
+                    raise
+                attempt += 1
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    @staticmethod
+    def _write_checkpoint(path, data):
+        tmp_path = path + '.tmp'
 
-            self._load(data, tag, historical, ts_index, chunk_size)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
 
-        self._build_linq(tag, num_cols, columns)
+        os.replace(tmp_path, path)
 
-    def load(self, data, tag, historical=True, ts_index=None, ts_name=None, columns=None):
+    def load(self, data, tag, historical=True, ts_index=None, ts_name=None, columns=None, connections=1):
 
         data = iter(data)
         first = next(data)
 
         if historical:
-            chunk_size = 50
             num_cols = len(first) - 1
         else:
-            chunk_size = 1
             num_cols = len(first)
 
         if isinstance(first, abc.Sequence):
@@ -114,54 +290,377 @@ class Loader:
                 columns = names
             data = self._process_mapping(data, first, names)
 
-        with self._connect_socket() as _:
-            self._load(data, tag, historical, ts_index, chunk_size)
+        stats = self._start_stats(tag)
+        self._load(data, tag, historical, ts_index, connections, stats)
+        self._finish_stats(stats)
 
-        self._build_linq(tag, num_cols, columns)
+        self._build_linq(tag, num_cols, columns, self.message_format)
 
-    def load_df(self, df, tag, ts_name):
+    def load_df(self, df, tag, ts_name, connections=1):
 
         columns = list(df.columns)
         columns.remove(ts_name)
         num_cols = len(columns)
 
-        data = df.to_dict(orient='records')
-        self.load(data, tag, historical=True, ts_name=ts_name)
-        self._build_linq(tag, num_cols, columns)
+        stats = self._start_stats(tag)
+        self._send(self._df_batches(df, tag, ts_name, columns), connections, stats=stats)
+        self._finish_stats(stats)
+
+        self._build_linq(tag, num_cols, columns, self.message_format)
+
+    def _start_stats(self, tag):
+        stats = LoadStats(tag)
+        self.load_stats = stats
+        return stats
+
+    def _finish_stats(self, stats):
+        stats.finished = time.time()
+        for hook in self.hooks:
+            hook(stats)
+
+    def _df_batches(self, df, tag, ts_name, columns):
+        """
+        Yields encoded rows of df in batches of
+        at least self.batch_bytes
+        """
+
+        header = self._make_message_header(tag, historical=True)
+        buffer = bytearray()
+
+        for i in range(0, len(df), self.df_chunk_rows):
+            chunk = df.iloc[i:i + self.df_chunk_rows]
+            buffer += self._encode_df(chunk, header, ts_name, columns, self.message_format)
+
+            if len(buffer) >= self.batch_bytes:
+                yield buffer
+                buffer.clear()
+
+        if buffer:
+            yield buffer
+
+    @classmethod
+    def _encode_df(cls, df, header, ts_name, columns, message_format='indices'):
+        """
+        Column-wise equivalent of _make_msg, or _make_compact_msg,
+        for every row of a DataFrame
+
+        Each column is converted to strings once and the
+        indices of all rows are computed in a single cumsum
+
+        :return: encoded messages of all rows
+        """
+
+        prefix, suffix = header.split('{0}')
+
+        ts = cls._stringify(df[ts_name])
+        values = [cls._stringify(df[c]) for c in columns]
 
-    def _load(self, data, tag, historical, ts_index=None, chunk_size=50):
+        lengths = np.zeros((len(df), len(columns) + 1), dtype=np.int64)
+        for j, col in enumerate(values):
+            lengths[:, j + 1] = cls._str_len(col)
+
+        indices = np.cumsum(lengths, axis=1)
+
+        if message_format == 'compact':
+            msgs = prefix + ts + suffix + cls._compact_offsets(indices)
+        else:
+            indices = indices.astype(str).astype(object)
+
+            msgs = prefix + ts + suffix + indices[:, 0]
+            for j in range(1, indices.shape[1]):
+                msgs = msgs + ',' + indices[:, j]
+
+            msgs = msgs + '<>'
+
+        for col in values:
+            msgs = msgs + col
+
+        return (''.join(msgs + '\n')).encode()
+
+    @staticmethod
+    def _compact_offsets(indices):
+        """
+        :param indices: start of every column and the length of
+                        the payload of each row, as in _encode_df
+        :return: object array of the version, width and zero padded
+                 offsets of each row as built by _make_compact_msg
+        """
+
+        widths = np.char.str_len(indices[:, -1].astype(str))
+        offsets = indices[:, 1:-1]
+        text = np.empty(len(indices), dtype=object)
+
+        for width in np.unique(widths):
+            rows = widths == width
+            text[rows] = COMPACT_VERSION + str(width)
+
+            if offsets.shape[1]:
+                padded = np.char.zfill(offsets[rows].astype(str), width).astype('<U{0}'.format(width))
+                # the padded offsets of a row are adjacent in memory and read as one string
+                joined = np.ascontiguousarray(padded).view('<U{0}'.format(width * offsets.shape[1]))
+                text[rows] = text[rows] + joined.ravel().astype(object)
+
+        return text
+
+    @staticmethod
+    def _stringify(s):
+        """
+        Converts a column to an array of python strings equal to
+        calling str on the values of df.to_dict(orient='records')
+        """
+
+        if s.dtype.kind == 'M' and isinstance(s.dtype, np.dtype) and not s.hasnans:
+            values = Loader._stringify_datetimes(s.to_numpy())
+            if values is not None:
+                return values
+
+        # masked extension arrays (ie Int64) give None for missing values in to_dict
+        if getattr(s.dtype, 'na_value', None) is pd.NA:
+            values = s.to_numpy(dtype=object, na_value=None)
+        else:
+            values = s.to_numpy(dtype=object)
+
+        return np.frompyfunc(str, 1, 1)(values)
+
+    @staticmethod
+    def _stringify_datetimes(values):
+        """
+        Vectorized str of pandas.Timestamp for naive datetime64 values:
+        YYYY-mm-dd HH:MM:SS with .ffffff only when there are microseconds
+
+        :return: object array of strings, or None if values have
+                 nanoseconds or years that need the slow path
+        """
+
+        seconds = values.astype('datetime64[s]')
+        micros = (values - seconds).astype('timedelta64[us]')
+
+        if (seconds + micros != values).any():
+            return None
+
+        years = seconds.astype('datetime64[Y]').astype(np.int64) + 1970
+        if ((years < 1) | (years > 9999)).any():
+            return None
+
+        text = np.datetime_as_string(seconds).astype('<U19')
+
+        # replace the T separator in place on the UCS4 code points
+        text.view(np.uint32).reshape(len(text), 19)[:, 10] = ord(' ')
+        text = text.astype(object)
+
+        micros = micros.astype(np.int64)
+        has_micros = micros != 0
+
+        if has_micros.any():
+            frac = (micros[has_micros] + 10**6).astype('<U7')
+            frac.view(np.uint32).reshape(len(frac), 7)[:, 0] = ord('.')
+            text[has_micros] = text[has_micros] + frac.astype(object)
+
+        return text
+
+    @staticmethod
+    def _str_len(values):
+        return np.frompyfunc(len, 1, 1)(values).astype(np.int64)
+
+    def _load(self, data, tag, historical, ts_index=None, connections=1, stats=None):
         """
 
         :param data: iterable of either lists
         :param tag:
         :param historical:
         :param ts_index:
+        :param connections: number of connections to the relay
+        :param stats: LoadStats in which the load is recorded
         :return:
         """
 
+        self._send(self._batches(data, tag, historical, ts_index), connections, stats=stats)
+
+    def _batches(self, data, tag, historical, ts_index=None):
+        """
+        Encodes rows into a byte buffer that is yielded
+        whenever it holds at least self.batch_bytes.
+        Real time rows are yielded as soon as they are encoded
+        so they are received with the current time
+
+        The buffer is reused, consumers must copy batches
+        they keep after requesting the next one
+        """
+
         message_header_base = self._make_message_header(tag, historical)
-        counter = 0
-        bulk_msg = ''
+        make_msg = self._make_compact_msg if self.message_format == 'compact' else self._make_msg
+        batch_bytes = self.batch_bytes if historical else 0
+        buffer = bytearray()
 
         if not historical:
             message_header = message_header_base
-        
+
         for row in data:
 
             if historical:
                 ts = row.pop(ts_index)
                 message_header = message_header_base.format(ts)
 
-            bulk_msg += self._make_msg(message_header, row)
-            counter += 1
+            buffer += make_msg(message_header, row).encode()
 
-            if counter == chunk_size:
-                self.sock.sendall(bulk_msg.encode())
-                counter = 0
-                bulk_msg = ''
+            if len(buffer) >= batch_bytes:
+                yield buffer
+                buffer.clear()
 
-        if bulk_msg:
-            self.sock.sendall(bulk_msg.encode())
+        if buffer:
+            yield buffer
+
+    def _send(self, batches, connections=1, on_sent=None, stats=None):
+        """
+        Send encoded batches to the relay over one or more connections
+
+        :param on_sent: function called with each batch after it is
+                        sent over a single connection
+        :param stats: LoadStats in which batches, bytes and
+                      time spent sending are counted
+        """
+
+        stats = stats or LoadStats()
+
+        if self.spool is not None:
+            assert connections == 1, "Spooled loads are sent over the single connection of the spool"
+            self._append_spool(batches, on_sent, stats)
+            return
+
+        if connections > 1:
+            self._send_parallel(batches, connections, stats)
+            return
+
+        with self._connect_socket() as _:
+            for batch in batches:
+                t = time.perf_counter()
+                self.sock.sendall(batch)
+                stats.send_seconds += time.perf_counter() - t
+                stats.batches += 1
+                stats.bytes += len(batch)
+                if on_sent is not None:
+                    on_sent(batch)
+
+    def _append_spool(self, batches, on_sent, stats):
+        """
+        Writes batches to the spool instead of sending them, so
+        send_seconds is the time spent writing to disk
+        """
+
+        for batch in batches:
+            t = time.perf_counter()
+            self.spool.append(batch)
+            stats.send_seconds += time.perf_counter() - t
+            stats.batches += 1
+            stats.bytes += len(batch)
+            if on_sent is not None:
+                on_sent(batch)
+
+    def _send_parallel(self, batches, connections, stats):
+        """
+        Sends batches over several connections that take
+        batches from a shared queue.  Batches are not sent
+        in order.
+
+        When a connection fails the batch it was sending is
+        handed to the remaining connections, so it may be
+        received twice but is never dropped.  An exception is
+        raised if batches are left unsent when every connection
+        has failed.
+
+        Throughput of each connection is added to
+        stats.connections
+        """
+
+        work = queue.Queue(maxsize=4 * connections)
+        retry = deque()
+        connection_stats = [{'batches': 0, 'bytes': 0, 'send_seconds': 0.0, 'error': None}
+                            for _ in range(connections)]
+
+        senders = [threading.Thread(target=self._sender, args=(work, retry, c), daemon=True)
+                   for c in connection_stats]
+
+        for sender in senders:
+            sender.start()
+
+        complete = True
+        for batch in itertools.chain(batches, [None] * connections):
+            if batch is not None:
+                batch = bytes(batch)
+            if not self._put(work, batch, senders):
+                # every connection failed so the queue is no longer consumed
+                complete = False
+                break
+
+        for sender in senders:
+            sender.join()
+
+        for c in connection_stats:
+            c['bytes_per_second'] = c['bytes'] / c['send_seconds'] if c['send_seconds'] else 0.0
+            stats.batches += c['batches']
+            stats.bytes += c['bytes']
+            stats.send_seconds += c['send_seconds']
+        stats.connections = connection_stats
+
+        unsent = len(retry)
+        while not work.empty():
+            if work.get() is not None:
+                unsent += 1
+
+        if unsent or not complete:
+            errors = [c['error'] for c in connection_stats if c['error']]
+            raise Exception('Load failed with {0} or more batches not sent: {1}'.format(unsent, errors[0]))
+
+    @staticmethod
+    def _put(work, batch, senders, timeout=0.5):
+        """
+        Put batch in the queue as long as a sender is alive
+
+        :return: False if every sender has stopped
+        """
+        while True:
+            try:
+                work.put(batch, timeout=timeout)
+                return True
+            except queue.Full:
+                if not any(sender.is_alive() for sender in senders):
+                    return False
+
+    def _sender(self, work, retry, stats):
+        """
+        Sends batches from work over its own connection
+        until it receives None or the connection fails
+        """
+
+        try:
+            sock = self._open_socket()
+        except Exception as e:
+            stats['error'] = e
+            return
+
+        with sock:
+            while True:
+                try:
+                    batch = retry.popleft()
+                except IndexError:
+                    batch = work.get()
+
+                if batch is None:
+                    if retry:
+                        continue
+                    return
+
+                t = time.perf_counter()
+                try:
+                    sock.sendall(batch)
+                except Exception as e:
+                    retry.append(batch)
+                    stats['error'] = e
+                    return
+
+                stats['send_seconds'] += time.perf_counter() - t
+                stats['batches'] += 1
+                stats['bytes'] += len(batch)
 
     @staticmethod
     def _make_message_header(tag, historical):
@@ -191,7 +690,7 @@ class Loader:
         lengths = [len(s) for s in row]
         lengths.insert(0, 0)
 
-        indices = np.cumsum(lengths)
+        indices = itertools.accumulate(lengths)
         indices = ','.join(str(i) for i in indices)
 
         row_concated = ''.join(row)
@@ -200,6 +699,26 @@ class Loader:
 
         return header + msg + '\n'
 
+    @staticmethod
+    def _make_compact_msg(header, row):
+        """
+        _make_msg in the compact format: the version and the width
+        w of the offsets, then the start of every column after the
+        first as a number of w digits, then the concatenated columns.
+        Offsets have a fixed position so each column is extracted
+        without reading the others
+
+        :param row: list with column values as strings
+        """
+
+        payload = ''.join(row)
+        width = len(str(len(payload)))
+
+        offsets = itertools.accumulate(map(len, row[:-1]))
+        offsets = ''.join([str(o).zfill(width) for o in offsets])
+
+        return header + COMPACT_VERSION + str(width) + offsets + payload + '\n'
+
     @staticmethod
     def _process_seq(data, first):
         yield [str(c) for c in first]
@@ -213,11 +732,15 @@ class Loader:
             yield [str(row[c]) for c in names]
 
     @staticmethod
-    def _build_linq(tag, num_cols, columns=None):
+    def _build_linq(tag, num_cols, columns=None, message_format='indices'):
 
         if columns is None:
             columns = ['col_{0}'.format(i) for i in range(num_cols)]
 
+        if message_format == 'compact':
+            print(Loader._build_compact_linq(tag, columns))
+            return
+
         col_extract = '''
         select substring(payload,
         int(split(indices, ",", {i})),
@@ -238,6 +761,33 @@ class Loader:
 
         print(linq)
 
+    @staticmethod
+    def _build_compact_linq(tag, columns):
+        """
+        Query extracting the columns of messages in the compact
+        format.  Every offset is read from a fixed position, so
+        each column takes a constant number of operations
+        """
+
+        num_offsets = len(columns) - 1
+
+        selects = [
+            'select int(substring(message, 1, 1)) as width',
+            'select substring(message, 2 + {n}*width, length(message) - 2 - {n}*width) as payload'.format(n=num_offsets)
+        ]
+
+        for i in range(num_offsets):
+            selects.append('select int(substring(message, 2 + {i}*width, width)) as offset_{j}'.format(i=i, j=i + 1))
+
+        starts = ['0'] + ['offset_{0}'.format(j) for j in range(1, len(columns))]
+        stops = starts[1:] + ['length(payload)']
+
+        for col_name, start, stop in zip(columns, starts, stops):
+            length = stop if start == '0' else '{0} - {1}'.format(stop, start)
+            selects.append('select substring(payload, {0}, {1}) as `{2}`'.format(start, length, col_name))
+
+        return '\n        from {0}\n\n'.format(tag) + ''.join('        {0}\n'.format(line) for line in selects)
+
 
 if __name__ == "__main__":
     l = Loader()
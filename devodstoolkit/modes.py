@@ -0,0 +1,147 @@
+import json
+from collections import defaultdict
+from .error_checking import check_status, QueryError
+from .timestamps import PARSERS, MS_PARSERS
+
+
+# response modes API.query can decode, the types of the columns of
+# the json modes are sent with the results so no probe is needed
+QUERY_MODES = ('csv', 'json/compact', 'json/simple/compact')
+
+
+def read_compact(text):
+    """
+    Decodes a json/compact response, a single object
+    with the columns in object.m and the rows in object.d
+
+    :param text: TextStream of the response
+    :return: column types, column names and an iterator of rows
+    """
+
+    data = json.loads(text.read())
+    check_status(data)
+
+    type_dict, cols = _columns(data['object']['m'])
+
+    return type_dict, cols, iter(data['object']['d'])
+
+
+def read_simple_compact(text):
+    """
+    Decodes a json/simple/compact response, one object per line:
+    the columns in m followed by each row in d
+    """
+
+    lines = iter(text)
+    first = json.loads(next(lines))
+
+    if 'status' in first:
+        check_status(first)
+        first = first['object']
+
+    type_dict, cols = _columns(first['m'])
+
+    return type_dict, cols, _simple_rows(lines)
+
+
+def _simple_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+
+        data = json.loads(line)
+
+        if 'd' in data:
+            yield data['d']
+        elif 'status' in data:
+            check_status(data)
+        elif 'e' in data:
+            raise QueryError(data['e'])
+
+
+def _columns(meta):
+    """
+    :return: column types and the column names in
+             the order of the values of each row
+    """
+
+    cols = sorted(meta, key=lambda c: meta[c].get('index', 0))
+
+    return {c: meta[c]['type'] for c in cols}, cols
+
+
+DECODERS = {
+    'json/compact': read_compact,
+    'json/simple/compact': read_simple_compact
+}
+
+
+def csv_type_map(timestamps='datetime'):
+    """
+    Conversions of the text of csv cells to python values
+    by Devo type, with empty cells as None.  Types without a
+    conversion are returned as the text received
+    """
+
+    funcs = {
+            'timestamp': PARSERS[timestamps],
+            'str': str,
+            'int8': int,
+            'int4': int,
+            'float8': float,
+            'float4': float,
+            'bool': lambda b: b == 'true'
+           }
+
+    return defaultdict(lambda: str, {t: _csv_null_decorator(f) for t, f in funcs.items()})
+
+
+def _csv_null_decorator(f):
+    def null_f(v):
+        if v == '':
+            return None
+        else:
+            return f(v)
+    return null_f
+
+
+def json_type_map(timestamps='datetime'):
+    """
+    Conversions of json values to the values returned for csv
+    responses by csv_type_map.  json values are already
+    typed so only timestamps, sent as milliseconds, are parsed
+    """
+
+    def timestamp(v):
+        if isinstance(v, str):
+            return PARSERS[timestamps](v)
+        return MS_PARSERS[timestamps](v)
+
+    def boolean(v):
+        if isinstance(v, bool):
+            return v
+        return v == 'true'
+
+    def other(v):
+        # types without conversions are strings with '' for nulls
+        return '' if v is None else str(v)
+
+    funcs = {
+        'timestamp': timestamp,
+        'str': str,
+        'int8': int,
+        'int4': int,
+        'float8': float,
+        'float4': float,
+        'bool': boolean
+    }
+
+    return defaultdict(lambda: other, {t: _null_decorator(f) for t, f in funcs.items()})
+
+
+def _null_decorator(f):
+    def null_f(v):
+        if v is None or v == '':
+            return None
+        return f(v)
+    return null_f
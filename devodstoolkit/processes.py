@@ -0,0 +1,75 @@
+import io
+import sys
+import csv
+from .modes import csv_type_map
+
+
+csv.field_size_limit(sys.maxsize)
+
+# type maps of each timestamps setting built in this process
+_type_maps = {}
+
+
+def convert_rows(text, type_names, timestamps='datetime'):
+    """
+    Parses and converts csv rows in a worker process,
+    as API._stream does for each row
+
+    :param text: whole csv rows
+    :param type_names: Devo type of each column
+    :param timestamps: representation of timestamps, as in API
+    :return: list of rows of converted values
+    """
+
+    type_map = _type_maps.get(timestamps)
+    if type_map is None:
+        type_map = _type_maps[timestamps] = csv_type_map(timestamps)
+
+    type_list = [type_map[t] for t in type_names]
+
+    return [[t(v) for t, v in zip(type_list, row)] for row in csv.reader(io.StringIO(text, newline=''))]
+
+
+def row_blocks(text):
+    """
+    Splits the csv text of a TextStream into blocks of
+    whole rows, about as large as the blocks it is read in
+
+    :param text: TextStream positioned at the start of a row
+    """
+
+    carry = ''
+
+    while True:
+        block = text.read_block()
+        if not block:
+            break
+
+        block = carry + block
+        end = last_row_end(block)
+        carry = block[end:]
+
+        if end:
+            yield block[:end]
+
+    if carry:
+        yield carry
+
+
+def last_row_end(text):
+    """
+    :param text: csv text starting at the start of a row
+    :return: position after the last newline that is not in a
+             quoted field, or 0 if text has no complete row
+    """
+
+    end = text.rfind('\n')
+    quotes = text.count('"', 0, end)
+
+    # a newline ends a row when it is preceded by an even number of quotes
+    while end >= 0 and quotes % 2:
+        previous = text.rfind('\n', 0, end)
+        quotes -= text.count('"', previous + 1, end)
+        end = previous
+
+    return end + 1
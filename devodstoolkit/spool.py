@@ -0,0 +1,349 @@
+import os
+import re
+import time
+import threading
+from .stats import SpoolStats
+
+
+SEGMENT_NAME = re.compile(r'^(\d{12})\.log$')
+
+
+class Spool(object):
+    """
+    Append only log of encoded batches kept in segment files of
+    a directory, and sent to the relay by a background thread,
+    so loads return once their rows are written to disk and a
+    slow or unreachable relay does not stall them
+
+    Segments are sent in order in reads of send_bytes and removed
+    once they are fully sent and no longer written to.  The offset
+    sent of the oldest segment is saved next to it at most once a
+    second, so after a restart the spool resumes from there and
+    rows sent after the last save are sent again.  Rows of a batch
+    being sent when the connection fails may also be sent twice.
+
+    After a connection error the sender waits retry_wait seconds,
+    doubling on every failed attempt up to max_retry_wait, and
+    keeps retrying until the spool is closed
+
+    A directory must only be used by one Spool at a time
+    """
+
+    # a new segment is started once the current one holds this many bytes
+    segment_bytes = 2**26
+    # bytes read from a segment and sent at once
+    send_bytes = 2**20
+    # longest wait between reconnection attempts
+    max_retry_wait = 60
+    # seconds of sends over which drain_bytes_per_second is measured
+    rate_window = 10
+    # fsync every append, so rows survive a crash of the machine
+    # and not only of the process
+    sync = False
+
+    def __init__(self, directory, connect, retry_wait=1):
+        """
+        :param directory: path of the directory of the segments,
+                          created if it does not exist
+        :param connect: function returning a new socket
+                        connected to the relay
+        :param retry_wait: seconds to wait after the first
+                           connection error
+        """
+
+        self.directory = directory
+        self.connect = connect
+        self.retry_wait = retry_wait
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._closed = threading.Event()
+        self._stats = SpoolStats(self.rate_window)
+        self._error = None
+
+        # committed size of every segment not yet removed, oldest first
+        self._segments = {}
+        self._offset = 0
+        self._active = None
+        self._file = None
+        self._recover()
+
+        self._thread = threading.Thread(target=self._send, daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        with self._lock:
+            self._stats.segments = len(self._segments)
+            self._stats.depth_bytes = sum(self._segments.values()) - self._offset
+        return self._stats
+
+    def append(self, batch):
+        """
+        Writes an encoded batch of whole messages to the current segment
+        """
+
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._closed.is_set():
+                raise Exception('Spool {0} is closed'.format(self.directory))
+
+            if self._file is None or self._segments[self._active] >= self.segment_bytes:
+                self._start_segment()
+
+            try:
+                self._file.write(batch)
+                self._file.flush()
+                if self.sync:
+                    os.fsync(self._file.fileno())
+            except BaseException:
+                self._abandon_segment()
+                raise
+
+            self._segments[self._active] += len(batch)
+            self._stats.spooled_bytes += len(batch)
+            self._changed.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Waits until every batch appended has been sent
+
+        :return: True if the spool is empty, False on timeout
+        """
+
+        def empty():
+            return self._error is not None or sum(self._segments.values()) == self._offset
+
+        with self._lock:
+            drained = self._changed.wait_for(empty, timeout)
+
+            if self._error is not None:
+                raise self._error
+
+        return drained
+
+    def close(self):
+        """
+        Stops the sender.  Batches not yet sent stay in the
+        directory and are sent by the next Spool opened on it
+        """
+
+        with self._lock:
+            self._closed.set()
+            self._changed.notify_all()
+
+        self._thread.join()
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._active = None
+
+            oldest = next(iter(self._segments), None)
+            if oldest is not None:
+                if self._offset == self._segments[oldest] and len(self._segments) == 1:
+                    self._remove(oldest)
+                else:
+                    self._save_offset(oldest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _path(self, seq, suffix='.log'):
+        return os.path.join(self.directory, '{0:012d}{1}'.format(seq, suffix))
+
+    def _recover(self):
+        """
+        Finds the segments left by a previous Spool, dropping
+        any partial message at the end of a segment that was
+        being written when the process stopped
+        """
+
+        found = sorted(int(m.group(1)) for m in map(SEGMENT_NAME.match, os.listdir(self.directory)) if m)
+
+        for seq in found:
+            self._segments[seq] = self._truncate_partial(self._path(seq))
+
+        if found:
+            offset_path = self._path(found[0], '.sent')
+            if os.path.exists(offset_path):
+                with open(offset_path, 'r') as f:
+                    self._offset = min(int(f.read()), self._segments[found[0]])
+
+        self._next_seq = found[-1] + 1 if found else 0
+
+    def _truncate_partial(self, path):
+        """
+        :return: size of the segment up to the end of its last message
+        """
+
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+
+            while end > 0:
+                start = max(end - self.send_bytes, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+
+            if end < size:
+                f.truncate(end)
+
+        return end
+
+    def _start_segment(self):
+        if self._file is not None:
+            self._file.close()
+
+        self._active = self._next_seq
+        self._next_seq += 1
+        self._segments[self._active] = 0
+        self._file = open(self._path(self._active), 'ab')
+
+    def _abandon_segment(self):
+        """
+        Stops writing to the active segment after a failed write,
+        removing the part of the batch that was written.  The next
+        append starts a new segment, and the sender only reads this
+        one up to its committed size even if it can't be truncated
+        """
+
+        f, self._file = self._file, None
+
+        try:
+            f.close()
+        except OSError:
+            pass
+
+        try:
+            os.truncate(self._path(self._active), self._segments[self._active])
+        except OSError:
+            pass
+
+        self._active = None
+
+    def _remove(self, seq):
+        os.remove(self._path(seq))
+
+        offset_path = self._path(seq, '.sent')
+        if os.path.exists(offset_path):
+            os.remove(offset_path)
+
+        del self._segments[seq]
+        self._offset = 0
+
+    def _save_offset(self, seq):
+        path = self._path(seq, '.sent')
+        tmp_path = path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            f.write(str(self._offset))
+
+        os.replace(tmp_path, path)
+
+    def _next_read(self):
+        """
+        Waits for bytes to send, removing segments that were fully sent
+
+        :return: oldest segment with bytes to send, the offset
+                 and the committed size, or None once closed
+        """
+
+        with self._lock:
+            while not self._closed.is_set():
+                seq = next(iter(self._segments), None)
+
+                if seq is not None and self._offset < self._segments[seq]:
+                    return seq, self._offset, self._segments[seq]
+
+                if seq is not None and seq != self._active:
+                    self._remove(seq)
+                    self._changed.notify_all()
+                    continue
+
+                self._changed.wait()
+
+        return None
+
+    def _send(self):
+        sock = None
+        f = None
+        f_seq = None
+        attempt = 0
+        last_save = time.time()
+
+        try:
+            while True:
+                read = self._next_read()
+                if read is None:
+                    break
+
+                seq, offset, size = read
+
+                if f_seq != seq:
+                    if f is not None:
+                        f.close()
+                    f = open(self._path(seq), 'rb')
+                    f_seq = seq
+
+                f.seek(offset)
+                chunk = f.read(min(self.send_bytes, size - offset))
+                if not chunk:
+                    raise Exception('Segment {0} is shorter than the bytes appended to it'.format(self._path(seq)))
+
+                # send whole messages, unless one is longer than send_bytes
+                end = chunk.rfind(b'\n') + 1 or len(chunk)
+
+                try:
+                    if sock is None:
+                        sock = self.connect()
+                        self._stats.connections += 1
+
+                    t = time.perf_counter()
+                    sock.sendall(memoryview(chunk)[:end])
+                    self._stats.send_seconds += time.perf_counter() - t
+                except OSError as e:
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+
+                    self._stats.errors += 1
+                    self._stats.last_error = e
+
+                    self._closed.wait(min(self.retry_wait * 2**attempt, self.max_retry_wait))
+                    attempt += 1
+                    continue
+
+                attempt = 0
+                self._stats.sent(end)
+
+                with self._lock:
+                    self._offset += end
+
+                    now = time.time()
+                    if now - last_save >= 1:
+                        self._save_offset(seq)
+                        last_save = now
+
+                    self._changed.notify_all()
+
+        except Exception as e:
+            with self._lock:
+                self._error = e
+                self._changed.notify_all()
+        finally:
+            if f is not None:
+                f.close()
+            if sock is not None:
+                sock.close()
@@ -0,0 +1,278 @@
+import time
+from collections import deque
+
+
+class QueryStats(object):
+    """
+    Timings and sizes of one query run by API
+
+    probe_seconds: finding the types of the columns
+    first_byte_seconds: from sending the query until the
+                        header of the results is received
+    read_seconds: waiting on the response stream
+    decode_seconds: decoding the response into text
+    parse_seconds: parsing csv rows and converting their
+                   values, including building DataFrames
+    bytes: size of the (decompressed) response
+    """
+
+    counters = ('probe_seconds', 'read_seconds', 'decode_seconds', 'process_seconds', 'bytes', 'rows')
+
+    def __init__(self, query=None, start=None, stop=None):
+        self.query = query
+        self.start = start
+        self.stop = stop
+
+        self.probe_seconds = 0.0
+        self.first_byte_seconds = None
+        self.read_seconds = 0.0
+        self.decode_seconds = 0.0
+        # time spent producing rows, which includes reading and decoding
+        self.process_seconds = 0.0
+        self.bytes = 0
+        self.rows = 0
+
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.started
+
+    @property
+    def parse_seconds(self):
+        return max(self.process_seconds - self.read_seconds - self.decode_seconds, 0.0)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def add(self, other):
+        """
+        Add the counters of other, ie of one window
+        of a query run in parallel
+        """
+        for name in self.counters:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        if self.first_byte_seconds is None:
+            self.first_byte_seconds = other.first_byte_seconds
+
+    def as_dict(self):
+        return {
+            'query': self.query,
+            'start': self.start,
+            'stop': self.stop,
+            'seconds': self.seconds,
+            'probe_seconds': self.probe_seconds,
+            'first_byte_seconds': self.first_byte_seconds,
+            'read_seconds': self.read_seconds,
+            'decode_seconds': self.decode_seconds,
+            'parse_seconds': self.parse_seconds,
+            'bytes': self.bytes,
+            'rows': self.rows,
+            'rows_per_second': self.rows_per_second
+        }
+
+    def __repr__(self):
+        return 'QueryStats(rows={0}, bytes={1}, seconds={2:.3f})'.format(self.rows, self.bytes, self.seconds)
+
+
+class LoadStats(object):
+    """
+    Sizes and timings of one load run by Loader
+
+    send_seconds: time blocked in sendall
+    connections: per connection batches, bytes, send_seconds,
+                 bytes_per_second and error when loading over
+                 several connections
+    rows and offset are only counted by load_file
+    """
+
+    def __init__(self, tag=None):
+        self.tag = tag
+
+        self.batches = 0
+        self.bytes = 0
+        self.send_seconds = 0.0
+        self.rows = None
+        self.offset = None
+        self.connections = []
+
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.started
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes_per_second / 2**20
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.rows and self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'tag': self.tag,
+            'seconds': self.seconds,
+            'batches': self.batches,
+            'bytes': self.bytes,
+            'send_seconds': self.send_seconds,
+            'bytes_per_second': self.bytes_per_second,
+            'mb_per_second': self.mb_per_second,
+            'rows': self.rows,
+            'rows_per_second': self.rows_per_second,
+            'offset': self.offset,
+            'connections': self.connections
+        }
+
+    def __repr__(self):
+        return 'LoadStats(batches={0}, bytes={1}, seconds={2:.3f})'.format(self.batches, self.bytes, self.seconds)
+
+
+class TailStats(object):
+    """
+    State of the reader of a continuous query run by API.tail
+
+    rows: rows read, including dropped rows
+    queued: rows waiting in the queue to be consumed
+    max_queued: largest number of rows waiting in the queue
+    blocked_seconds: time the reader waited on a full queue,
+                     during which the response is not read
+    dropped: rows discarded because the queue was full
+    reconnects: times the query was restarted after the
+                connection was lost
+    duplicates: rows received again after reconnecting
+                that were skipped
+    last_timestamp: latest event timestamp read
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.blocked_seconds = 0.0
+        self.dropped = 0
+        self.reconnects = 0
+        self.duplicates = 0
+        self.last_timestamp = None
+
+        self.started = time.time()
+
+    @property
+    def seconds(self):
+        return time.time() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'rows': self.rows,
+            'rows_per_second': self.rows_per_second,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'blocked_seconds': self.blocked_seconds,
+            'dropped': self.dropped,
+            'reconnects': self.reconnects,
+            'duplicates': self.duplicates,
+            'last_timestamp': self.last_timestamp
+        }
+
+    def __repr__(self):
+        return 'TailStats(rows={0}, queued={1}, dropped={2}, reconnects={3})'.format(
+            self.rows, self.queued, self.dropped, self.reconnects)
+
+
+class SpoolStats(object):
+    """
+    State of the Spool of a Loader
+
+    segments: segment files not yet removed
+    depth_bytes: bytes spooled but not yet sent
+    spooled_bytes: bytes appended since the spool was opened
+    sent_bytes: bytes sent since the spool was opened
+    send_seconds: time blocked in sendall
+    drain_bytes_per_second: bytes sent per second over the
+                            last Spool.rate_window seconds
+    connections: connections opened to the relay
+    errors: connection errors, each followed by a wait
+            before reconnecting
+    last_error: the last connection error
+    """
+
+    def __init__(self, rate_window=10):
+        self.rate_window = rate_window
+
+        self.segments = 0
+        self.depth_bytes = 0
+        self.spooled_bytes = 0
+        self.sent_bytes = 0
+        self.send_seconds = 0.0
+        self.connections = 0
+        self.errors = 0
+        self.last_error = None
+
+        # time and bytes of recent sends
+        self._sends = deque()
+
+        self.started = time.time()
+
+    def sent(self, size):
+        now = time.time()
+        self.sent_bytes += size
+        self._sends.append((now, size))
+
+        while self._sends[0][0] < now - self.rate_window:
+            self._sends.popleft()
+
+    @property
+    def seconds(self):
+        return time.time() - self.started
+
+    @property
+    def drain_bytes_per_second(self):
+        now = time.time()
+        window = min(self.rate_window, now - self.started)
+        if window <= 0:
+            return 0.0
+
+        return sum(size for t, size in list(self._sends) if t >= now - window) / window
+
+    @property
+    def drain_seconds(self):
+        """
+        Estimated time to send the depth at the current drain rate
+        """
+        rate = self.drain_bytes_per_second
+        return self.depth_bytes / rate if rate else None
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'segments': self.segments,
+            'depth_bytes': self.depth_bytes,
+            'spooled_bytes': self.spooled_bytes,
+            'sent_bytes': self.sent_bytes,
+            'send_seconds': self.send_seconds,
+            'drain_bytes_per_second': self.drain_bytes_per_second,
+            'drain_seconds': self.drain_seconds,
+            'connections': self.connections,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+    def __repr__(self):
+        return 'SpoolStats(segments={0}, depth_bytes={1}, drain_bytes_per_second={2:.0f})'.format(
+            self.segments, self.depth_bytes, self.drain_bytes_per_second)
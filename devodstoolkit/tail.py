@@ -0,0 +1,240 @@
+import csv
+import math
+import time
+import queue
+import threading
+from collections import Counter
+import requests
+from .error_checking import QueryError
+from .timestamps import parse_datetime, EPOCH
+from .stats import TailStats
+
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+
+class StreamEnded(Exception):
+    pass
+
+
+class Tail(object):
+    """
+    Reads a continuous query in a background thread into a
+    bounded queue, so a slow consumer does not stall the
+    response and the response does not wait on the consumer
+    until the queue is full
+
+    When the connection is lost the query is restarted from
+    the second of the last event timestamp read, skipping the
+    rows of that second that were already read.  This assumes
+    rows arrive in time order, as they do for continuous queries
+
+    Created by API.tail, iterate over it to get the rows
+    """
+
+    # longest wait between reconnection attempts
+    max_retry_wait = 60
+
+    def __init__(self, api, linq_query, start, output='dict', ts_name='eventdate', queue_size=10000,
+                 overflow='block', retries=None, retry_wait=1, types=None):
+
+        assert overflow in OVERFLOW_POLICIES, "overflow must be one of {0}".format(OVERFLOW_POLICIES)
+        assert output in ('dict', 'list', 'namedtuple'), "output must be 'dict', 'list' or 'namedtuple'"
+
+        self.api = api
+        self.query_text = api._read_query(linq_query)
+        self.output = output
+        self.ts_name = ts_name
+        self.overflow = overflow
+        self.retries = retries
+        self.retry_wait = retry_wait
+
+        self.type_dict = types if types is not None else api._get_types(linq_query, start)
+        self.columns = None
+
+        self._start = api._to_unix(start)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stats = TailStats()
+        self._closed = threading.Event()
+        self._header = threading.Event()
+        self._response = None
+        self._error = None
+
+        # rows read in the current second and those expected
+        # again after reconnecting, to skip duplicates
+        self._second = None
+        self._seen = Counter()
+        self._replay = Counter()
+
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        self._stats.queued = self._queue.qsize()
+        return self._stats
+
+    def __iter__(self):
+        self._header.wait()
+        if self.columns is None:
+            raise self._error or Exception('Tail was closed before the query started')
+
+        type_list = [self.api._map[self.type_dict[c]] for c in self.columns]
+
+        return getattr(self.api, '_to_{0}'.format(self.output))(self._rows(type_list), self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stop reading the query
+        """
+
+        self._closed.set()
+
+        response = self._response
+        if response is not None:
+            response.close()
+
+        self._thread.join(timeout=5)
+
+    def _rows(self, type_list):
+        try:
+            while True:
+                row = self._queue.get()
+                if row is None:
+                    break
+                yield [t(v) for t, v in zip(type_list, row)]
+        finally:
+            self.close()
+
+        if self._error is not None:
+            raise self._error
+
+    def _read(self):
+        start = self._start
+        attempt = 0
+
+        try:
+            while not self._closed.is_set():
+                try:
+                    for row in self._stream(start):
+                        self._put(row)
+                        attempt = 0
+                    raise StreamEnded('Continuous query ended')
+                except (requests.exceptions.RequestException, OSError, StreamEnded):
+                    if self._closed.is_set():
+                        break
+                    if self.retries is not None and attempt >= self.retries:
+                        raise
+
+                wait = min(self.retry_wait * 2**attempt, self.max_retry_wait)
+                attempt += 1
+                self._stats.reconnects += 1
+
+                if self._second is not None:
+                    start = self._second
+                    self._replay = Counter(self._seen)
+
+                self._closed.wait(wait)
+
+        except Exception as e:
+            self._error = e
+        finally:
+            self._header.set()
+            self._end()
+
+    def _stream(self, start):
+        """
+        Yields rows of the query from start that were not read before
+        """
+
+        self._response = self.api._make_request(self.query_text, start, None, 'csv', True, None)
+
+        if self._closed.is_set():
+            return
+
+        blocks = self._response.iter_content(chunk_size=self.api.continuous_block_size)
+        first, lines = self.api._decode_results(blocks)
+        cols = next(csv.reader([first]))
+
+        if self.columns is None:
+            if self.ts_name not in cols:
+                raise QueryError('Column {0} is needed to resume the query'.format(self.ts_name))
+            self.columns = cols
+            self._ts_index = cols.index(self.ts_name)
+            self._header.set()
+
+        for row in csv.reader(lines):
+            if self._closed.is_set():
+                return
+            if not self._is_duplicate(row):
+                yield row
+
+    def _is_duplicate(self, row):
+        value = row[self._ts_index]
+        if not value:
+            return False
+
+        ts = parse_datetime(value)
+        second = math.floor((ts - EPOCH).total_seconds())
+
+        if self._second is None or second > self._second:
+            self._second = second
+            self._seen = Counter()
+            self._replay = Counter()
+        elif second < self._second:
+            return False
+
+        key = tuple(row)
+        if self._replay[key] > 0:
+            self._replay[key] -= 1
+            self._stats.duplicates += 1
+            return True
+
+        self._seen[key] += 1
+        if self._stats.last_timestamp is None or ts > self._stats.last_timestamp:
+            self._stats.last_timestamp = ts
+
+        return False
+
+    def _put(self, row):
+        self._stats.rows += 1
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            if self.overflow == 'drop_newest':
+                self._stats.dropped += 1
+                return
+
+            if self.overflow == 'drop_oldest':
+                try:
+                    self._queue.get_nowait()
+                    self._stats.dropped += 1
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(row)
+            else:
+                t = time.perf_counter()
+                self._wait_put(row)
+                self._stats.blocked_seconds += time.perf_counter() - t
+
+        self._stats.max_queued = max(self._stats.max_queued, self._queue.qsize())
+
+    def _wait_put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _end(self):
+        # the consumer may have stopped reading, so the end is never dropped
+        # but is abandoned once the Tail is closed
+        self._wait_put(None)
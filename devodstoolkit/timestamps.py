@@ -0,0 +1,93 @@
+import datetime
+from .lazy import lazy_import
+
+np = lazy_import('numpy', globals(), 'np')
+pd = lazy_import('pandas', globals(), 'pd')
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MILLISECOND = datetime.timedelta(milliseconds=1)
+
+TIMESTAMP_OUTPUTS = ('datetime', 'epoch_ms', 'datetime64')
+
+
+def parse_datetime(t):
+    """
+    Parse a Devo timestamp into a naive datetime in UTC.
+
+    fromisoformat is implemented in C and is much faster than
+    strptime, which is kept for fractions it can't read
+    (older versions of python only accept 3 or 6 digits)
+    """
+    t = t.strip()
+    try:
+        return datetime.datetime.fromisoformat(t)
+    except ValueError:
+        return datetime.datetime.strptime(t, TIMESTAMP_FORMAT)
+
+
+def parse_epoch_ms(t):
+    return (parse_datetime(t) - EPOCH) // MILLISECOND
+
+
+def parse_datetime64(t):
+    return np.datetime64(t.strip(), 'ns')
+
+
+PARSERS = {
+    'datetime': parse_datetime,
+    'epoch_ms': parse_epoch_ms,
+    'datetime64': parse_datetime64
+}
+
+
+def convert_timestamps(s, timestamps='datetime'):
+    """
+    Vectorized parse of a column of Devo timestamps
+
+    :param s: Series of timestamp strings, nulls as NaN
+    :param timestamps: 'datetime' and 'datetime64' return a datetime64
+                       Series, 'epoch_ms' returns milliseconds since epoch
+    """
+
+    s = pd.to_datetime(s.str.strip(), format=TIMESTAMP_FORMAT)
+
+    if timestamps == 'epoch_ms':
+        s = (s - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+
+    return s
+
+
+def datetime_from_ms(ms):
+    return EPOCH + datetime.timedelta(milliseconds=ms)
+
+
+def datetime64_from_ms(ms):
+    return np.datetime64(int(ms), 'ms').astype('datetime64[ns]')
+
+
+# for timestamps sent as milliseconds since epoch by the json modes
+MS_PARSERS = {
+    'datetime': datetime_from_ms,
+    'epoch_ms': int,
+    'datetime64': datetime64_from_ms
+}
+
+
+def convert_ms_timestamps(s, timestamps='datetime'):
+    """
+    convert_timestamps for a column of milliseconds since epoch,
+    nulls as None or NaN
+    """
+
+    s = pd.to_numeric(s)
+
+    if timestamps == 'epoch_ms':
+        return s
+
+    # same resolution as timestamps parsed from text, which depends on the version of pandas
+    text_dtype = convert_timestamps(pd.Series(['1970-01-01 00:00:00.000']), timestamps).dtype
+
+    return pd.to_datetime(s, unit='ms').astype(text_dtype)
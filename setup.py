@@ -18,5 +18,6 @@ setup(
     url='https://github.com/devods/devodstoolkit',
     python_requires='>=3',
     install_requires=requires,
+    extras_require={'arrow': ['pyarrow']},
     packages=find_packages()
 )